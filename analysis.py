@@ -0,0 +1,207 @@
+#############################################################################
+##
+##               LINEARIZATION AND FREQUENCY RESPONSE (analysis.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import numpy as np
+
+from blocks import Block, Integrator
+from linear import state_space
+
+
+# FUNCS =====================================================================
+
+def finite_differences(block, time, dt):
+
+    """
+    derivatives of the output of a block with respect to the
+    outputs of its input blocks by central differences, as
+    (input_block, derivative) pairs like 'Block.jacobian'
+
+    INPUTS:
+        block : (Block) block with feedthrough
+        time  : (float) simulation time
+        dt    : (float) timestep
+    """
+
+    output = block.output
+    derivatives = []
+
+    for input_block in dict.fromkeys(block.inputs.values()):
+
+        value = input_block.output
+        h = 6.06e-6 * max(1.0, abs(value))
+
+        input_block.output = value + h
+        block.compute(time, dt)
+        upper = block.output
+
+        input_block.output = value - h
+        block.compute(time, dt)
+        lower = block.output
+
+        input_block.output = value
+        derivatives.append((input_block, (upper - lower) / (2 * h)))
+
+    block.output = output
+
+    return derivatives
+
+
+def linearize(simulation, inputs, outputs):
+
+    """
+    linearize the block diagram of a simulation around its current
+    state, the operating point is given by the integrator outputs at
+    the time of the simulation, the derivatives of the blocks are
+    analytic where they provide 'Block.jacobian' (Amplifier, Adder,
+    Inverter, Multiplier, ...) and central differences otherwise
+    (e.g. Function), the state of the simulation is not changed
+
+    INPUTS:
+        simulation : (Simulation) simulation at the operating point
+        inputs     : (list) blocks or block ids whose outputs are the
+                     inputs of the model (e.g. Generator, Constant)
+        outputs    : (list) blocks or block ids whose outputs are the
+                     outputs of the model (e.g. Scope)
+    """
+
+    inputs  = [block if isinstance(block, Block) else simulation.get_block(block) for block in inputs]
+    outputs = [block if isinstance(block, Block) else simulation.get_block(block) for block in outputs]
+
+    if simulation.array_engine is not None:
+        simulation.array_engine.sync()
+
+    integrators = [block for block in simulation.integrators if block not in inputs]
+
+    #the outputs of all other blocks depend on the states and inputs
+    members = []
+    for block in simulation.blocks:
+        if block in inputs or isinstance(block, Integrator):
+            continue
+        if not block.feedthrough:
+            raise ValueError(f"Block {block.label}_{block.id} of type '{type(block).__name__}' cannot be linearized")
+        if len(block.inputs) > 0:
+            members.append(block)
+
+    states = [block.get_full_state() for block in simulation.blocks]
+
+    try:
+
+        #consistent outputs at the operating point
+        simulation._compute_blocks(simulation.time, simulation.dt, feedthrough_only=True)
+
+        jacobians = []
+        for block in members:
+            derivatives = block.jacobian()
+            jacobians.append(finite_differences(block, simulation.time, simulation.dt) if derivatives is None else derivatives)
+
+    finally:
+        for block, state in zip(simulation.blocks, states):
+            block.set_full_state(state)
+
+    A, B, C_members, D_members = state_space(integrators, members, inputs, jacobians)
+
+    #rows of the requested outputs
+    n, m = len(integrators), len(inputs)
+    C, D = np.zeros((len(outputs), n)), np.zeros((len(outputs), m))
+    for k, block in enumerate(outputs):
+        if block in inputs:
+            D[k, inputs.index(block)] = 1.0
+        elif block in integrators:
+            C[k, integrators.index(block)] = 1.0
+        elif block in members:
+            C[k], D[k] = C_members[members.index(block)], D_members[members.index(block)]
+
+    return LinearModel(A, B, C, D, integrators, inputs, outputs)
+
+
+# CLASSES ===================================================================
+
+class LinearModel:
+
+    """
+    linear state-space model of a block diagram
+
+        x' = A x + B u
+        y  = C x + D u
+
+    with the outputs of the integrators as states 'x', the outputs
+    of the input blocks as 'u' and the outputs of the output blocks
+    as 'y' (see 'linearize')
+    """
+
+    def __init__(self, A, B, C, D, states=[], inputs=[], outputs=[]):
+
+        """
+        INPUTS:
+            A, B, C, D : (array) state-space matrices
+            states     : (list) Integrator blocks of the states
+            inputs     : (list) input blocks
+            outputs    : (list) output blocks
+        """
+
+        self.A, self.B, self.C, self.D = A, B, C, D
+
+        self.states  = states
+        self.inputs  = inputs
+        self.outputs = outputs
+
+    def poles(self):
+        """
+        eigenvalues of the state matrix [1/s]
+        """
+        return np.linalg.eigvals(self.A)
+
+    def frequency_response(self, frequencies):
+
+        """
+        complex frequency response H = C (sI - A)^-1 B + D with
+        s = 2j pi f for all frequencies at once, returns an array
+        (frequencies, outputs, inputs), diagonalizable state matrices
+        use their eigenvectors and the others one solve per frequency
+
+        INPUTS:
+            frequencies : (array) frequencies [Hz]
+        """
+
+        s = 2j * np.pi * np.asarray(frequencies, dtype=float).reshape(-1)
+
+        response = np.broadcast_to(self.D.astype(complex), (len(s),) + self.D.shape).copy()
+        if len(self.A) == 0:
+            return response
+
+        eigenvalues, vectors = np.linalg.eig(self.A)
+
+        if np.linalg.cond(vectors) < 1e8:
+            #modal form, H = (C V) diag(1 / (s - eigenvalues)) (V^-1 B) + D
+            left = self.C @ vectors
+            right = np.linalg.solve(vectors, self.B)
+            response += np.einsum("pk,fk,km->fpm", left, 1 / (s[:, None] - eigenvalues), right)
+        else:
+            matrices = s[:, None, None] * np.eye(len(self.A)) - self.A
+            response += self.C @ np.linalg.solve(matrices, np.broadcast_to(self.B, (len(s),) + self.B.shape))
+
+        return response
+
+    def bode(self, frequencies):
+
+        """
+        returns the magnitude [dB] and the phase [deg] (unwrapped
+        over the frequencies) of the frequency response
+
+        INPUTS:
+            frequencies : (array) frequencies [Hz]
+        """
+
+        response = self.frequency_response(frequencies)
+
+        magnitude = 20 * np.log10(np.abs(response))
+        phase = np.degrees(np.unwrap(np.angle(response), axis=0))
+
+        return magnitude, phase
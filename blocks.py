@@ -8,7 +8,10 @@
 
 # IMPORTS ===================================================================
 
-from math import * #needed for the evaluation of the expressions
+import numpy as np
+
+from expressions import compile_expression, expression_names
+from tables import Table, tabulate
 
 
 # CLASSES ===================================================================
@@ -16,12 +19,26 @@ from math import * #needed for the evaluation of the expressions
 class Parameter:
 
     """
-    Parameter object that can be referenced by the blocks
+    Parameter object that can be referenced by the blocks,
+    the value can also be a vector with one value per 
+    variant for batched parameter sweeps
     """
 
     def __init__(self, parameter="x", value=1):
         self.parameter = parameter
-        self.value = float(value) if value is not None else None
+        if value is None:
+            self.value = None
+        elif np.ndim(value) > 0:
+            self.value = np.asarray(value, dtype=float)
+        else:
+            self.value = float(value)
+
+    @property
+    def batch_size(self):
+        """
+        number of variants for vector values, None for scalars
+        """
+        return np.size(self.value) if isinstance(self.value, np.ndarray) else None
 
 
 class Equation:
@@ -34,28 +51,41 @@ class Equation:
     def __init__(self, expression="z=3*x+y"):
         self.expression = expression
         self.left, self.right = expression.split("=")
-        self.func = lambda **kwargs : eval(self.right, kwargs)
+        self.names = expression_names(self.right)
 
     def compute(self, parameters=[]):
-        kwargs = {p.parameter : p.value for p in parameters if p.parameter in self.right}
+        arguments = [p for p in parameters if p.parameter in self.names]
+        vectorized = any(p.batch_size is not None for p in arguments)
+        func = compile_expression(self.right, [p.parameter for p in arguments], vectorized)
         for p in parameters:
             if p.parameter == self.left:
-                p.value = self.func(**kwargs)
+                p.value = func(*[a.value for a in arguments])
 
 
 class Block:
 
     """
     base Block object that defines the 
-    inputs and the connect method
+    inputs and the connect method, blocks with a 
+    'sample_time' are only computed on their own 
+    ticks and hold their outputs in between
     """
 
-    def __init__(self):
+    #output depends on the input within the same timestep
+    feedthrough = True
+
+    #attributes that change during the simulation (see 'get_full_state')
+    state_attributes = ("output",)
+
+    def __init__(self, sample_time=None):
 
         #general properties for simulation
         self.inputs = {}
         self.output = 0
 
+        #time between the updates (None for every timestep)
+        self.sample_time = sample_time
+
         #identifier for reference
         self.id = None
         
@@ -77,6 +107,38 @@ class Block:
     def check_parameter(self):
         pass
 
+    def check_sample_time(self):
+
+        #handle parameter for sample time
+        if isinstance(self.sample_time, Parameter):
+            self.sample_time = self.sample_time.value
+
+        if self.sample_time is not None:
+            self.sample_time = float(self.sample_time)
+            if self.sample_time <= 0:
+                raise ValueError(f"Sample time of block {self.label}_{self.id} has to be positive")
+
+    def get_full_state(self):
+        """
+        values of all attributes that change during the simulation
+        """
+        return tuple(getattr(self, name) for name in self.state_attributes)
+
+    def set_full_state(self, state):
+        """
+        restore the values from 'get_full_state'
+        """
+        for name, value in zip(self.state_attributes, state):
+            setattr(self, name, value)
+
+    def jacobian(self):
+        """
+        partial derivatives of the output with respect to the 
+        outputs of the input blocks as (input_block, derivative) 
+        pairs, None if unknown (finite differences are used)
+        """
+        return None
+
 
 class Amplifier(Block):
 
@@ -85,8 +147,8 @@ class Amplifier(Block):
     multiplication with a constant gain term
     """
 
-    def __init__(self, gain=1.0):
-        super().__init__()
+    def __init__(self, gain=1.0, sample_time=None):
+        super().__init__(sample_time)
         self.gain = gain
 
     def __str__(self):
@@ -108,6 +170,9 @@ class Amplifier(Block):
         self.output = self.gain * input_signal
         return self.output 
 
+    def jacobian(self):
+        return [(self.inputs['input'], self.gain)]
+
 
 class Integrator(Block):
 
@@ -117,8 +182,12 @@ class Integrator(Block):
     first step, that uses the forward euler rule
     """
 
-    def __init__(self, initial_value=0.0):
-        super().__init__()
+    feedthrough = False
+
+    state_attributes = ("output", "temp_output", "prev_input")
+
+    def __init__(self, initial_value=0.0, sample_time=None):
+        super().__init__(sample_time)
         self.output = initial_value
         self.temp_output = initial_value
         self.prev_input = None
@@ -160,8 +229,12 @@ class Differentiator(Block):
     differentiates the input signal
     """
 
-    def __init__(self):
-        super().__init__()
+    feedthrough = False
+
+    state_attributes = ("output", "temp_output", "prev_input")
+
+    def __init__(self, sample_time=None):
+        super().__init__(sample_time)
         self.prev_input = None
         self.temp_output = 0
 
@@ -190,8 +263,8 @@ class Comparator(Block):
     (essentially heaviside function)
     """
 
-    def __init__(self, threshold=0.0):
-        super().__init__()
+    def __init__(self, threshold=0.0, sample_time=None):
+        super().__init__(sample_time)
         self.threshold = threshold
 
     def __str__(self):
@@ -214,6 +287,9 @@ class Comparator(Block):
         input_signal = self.inputs['input'].output
         self.output = 1 if input_signal >= self.threshold else 0
 
+    def jacobian(self):
+        return [(self.inputs['input'], 0.0)]
+
 
 class Adder(Block):
 
@@ -233,6 +309,9 @@ class Adder(Block):
         for input_block in self.inputs.values():
             self.output += input_block.output
 
+    def jacobian(self):
+        return [(input_block, 1.0) for input_block in self.inputs.values()]
+
 
 class Multiplier(Block):
 
@@ -252,6 +331,17 @@ class Multiplier(Block):
         for input_block in self.inputs.values():
             self.output *= input_block.output
 
+    def jacobian(self):
+        input_blocks = list(self.inputs.values())
+        derivatives = []
+        for i, input_block in enumerate(input_blocks):
+            derivative = 1.0
+            for j, other_block in enumerate(input_blocks):
+                if i != j:
+                    derivative *= other_block.output
+            derivatives.append((input_block, derivative))
+        return derivatives
+
 
 class Constant(Block):
 
@@ -260,8 +350,8 @@ class Constant(Block):
     (same as Generator with fx="1")
     """
 
-    def __init__(self, value=1):
-        super().__init__()
+    def __init__(self, value=1, sample_time=None):
+        super().__init__(sample_time)
         self.output = value
 
     def __str__(self):
@@ -295,6 +385,9 @@ class Inverter(Block):
 
         self.output = -1 * self.inputs['input'].output
 
+    def jacobian(self):
+        return [(self.inputs['input'], -1.0)]
+
 
 class Generator(Block):
 
@@ -304,14 +397,24 @@ class Generator(Block):
     by the string in the argument
     """
 
-    def __init__(self, expression="sin(x)"):
-        super().__init__()
+    def __init__(self, expression="sin(x)", sample_time=None):
+        super().__init__(sample_time)
         self.expression = expression
-        self.func = lambda x: eval(expression, {"x": x})
+        self.func = compile_expression(expression)
 
     def __str__(self):
         return f"Generator {self.expression}"
 
+    def __getstate__(self):
+        #the compiled expression is not picklable
+        state = self.__dict__.copy()
+        del state["func"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.func = compile_expression(self.expression)
+
     def compute(self, t, dt):
         self.output = self.func(t)
 
@@ -320,17 +423,52 @@ class Function(Block):
 
     """
     arbitrary function block, defined 
-    by the string as the argument
+    by the string as the argument, 
+
+    optionally the expression is tabulated over the 
+    input range [lower, upper] to the absolute accuracy 
+    'tolerance' and interpolated (cubic) instead of 
+    evaluated, inputs outside the range are clamped
     """
 
-    def __init__(self, expression="x+1"):
-        super().__init__()
+    def __init__(self, expression="x+1", lower=None, upper=None, tolerance=1e-6, sample_time=None):
+        super().__init__(sample_time)
         self.expression = expression
-        self.func = lambda x : eval(expression, {"x": x})
+        self.func = compile_expression(expression)
+
+        #input range and accuracy of the tabulation (opt-in)
+        self.lower = lower
+        self.upper = upper
+        self.tolerance = tolerance
+        self.table = None
 
     def __str__(self):
         return f"Function {self.expression}"
 
+    def __getstate__(self):
+        #the compiled expression is not picklable
+        state = self.__dict__.copy()
+        del state["func"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.func = compile_expression(self.expression)
+        if self.table is not None:
+            self.func = self.table.scalar
+
+    def check_parameter(self):
+
+        if self.lower is None or self.upper is None:
+            return
+
+        #handle parameters for the tabulation
+        lower, upper, tolerance = [value.value if isinstance(value, Parameter) else float(value) 
+                                   for value in (self.lower, self.upper, self.tolerance)]
+
+        self.table = tabulate(compile_expression(self.expression), lower, upper, tolerance)
+        self.func = self.table.scalar
+
     def compute(self, t, dt):
 
         if len(self.inputs) == 0:
@@ -340,14 +478,58 @@ class Function(Block):
         self.output = self.func(input_signal)
 
 
+class LookupTable(Block):
+
+    """
+    interpolates the input signal in a table of 
+    strictly increasing breakpoints and their values, 
+    'linear' or 'cubic' (spline) interpolation, inputs 
+    outside of the breakpoints are clamped
+
+    the breakpoints and values are lists of numbers 
+    or strings of comma separated numbers '0,1,2'
+    """
+
+    def __init__(self, breakpoints="0,1", values="0,1", method="linear", sample_time=None):
+        super().__init__(sample_time)
+        self.breakpoints = breakpoints
+        self.values = values
+        self.method = method
+        self.table = None
+
+    def __str__(self):
+        return f"LookupTable {self.method}"
+
+    def check_parameter(self):
+
+        #handle comma separated numbers
+        breakpoints, values = [[float(v) for v in numbers.split(",")] if isinstance(numbers, str) else numbers 
+                               for numbers in (self.breakpoints, self.values)]
+
+        self.table = Table(breakpoints, values, self.method)
+        self.breakpoints = self.table.breakpoints
+        self.values = self.table.values
+
+    def compute(self, t, dt):
+
+        if len(self.inputs) == 0:
+            raise ValueError(f"No input defined for block {self.label}_{self.id}")
+
+        self.output = self.table.scalar(self.inputs['input'].output)
+
+    def jacobian(self):
+        input_block = self.inputs['input']
+        return [(input_block, self.table.derivative(input_block.output))]
+
+
 class Scope(Block):
     
     """
     block for visualization, input pass through
     """
 
-    def __init__(self, label="output"):
-        super().__init__()
+    def __init__(self, label="output", sample_time=None):
+        super().__init__(sample_time)
         self.label = label
 
     def __str__(self):
@@ -360,6 +542,9 @@ class Scope(Block):
 
         self.output = self.inputs['input'].output
 
+    def jacobian(self):
+        return [(self.inputs['input'], 1.0)]
+
 
 class Subsystem(Block):
 
@@ -369,8 +554,10 @@ class Subsystem(Block):
     input block and the last block is the output block
     """
 
-    def __init__(self, blocks=[], connections=[], label="Subsystem"):
-        super().__init__()
+    feedthrough = False
+
+    def __init__(self, blocks=[], connections=[], label="Subsystem", sample_time=None):
+        super().__init__(sample_time)
         self.blocks = blocks
         self.connections = connections
         self.label = label
@@ -386,6 +573,14 @@ class Subsystem(Block):
         for connection in self.connections:
             connection.target.connect(connection.target_input, connection.source)
 
+    def get_full_state(self):
+        return self.output, tuple(block.get_full_state() for block in self.blocks)
+
+    def set_full_state(self, state):
+        self.output, states = state
+        for block, block_state in zip(self.blocks, states):
+            block.set_full_state(block_state)
+
     def compute(self, t, dt):
         for block in self.blocks:
             block.compute(t, dt)
@@ -0,0 +1,228 @@
+#############################################################################
+##
+##                   CACHE OF LOADED SIMULATION FILES (cache.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import os
+import pickle
+import hashlib
+
+import numpy as np
+
+from parsers import parse_simulation_file
+from simulation import Simulation
+
+
+# GLOBALS ===================================================================
+
+#changes the keys of all entries when the cached objects change
+CACHE_VERSION = 4
+
+#default location of the cache files
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "analog_simulation")
+
+
+# FUNCS =====================================================================
+
+def subsystem_files(content):
+
+    """
+    returns the files of the subsystems that are referenced
+    by the content of a simulation file (without parsing it)
+
+    INPUTS:
+        content : (bytes) content of the simulation file
+    """
+
+    files = []
+    for line in content.decode().splitlines():
+        if "Subsystem" not in line:
+            continue
+        line, *_ = line.strip().split("#")
+        parts = line.split()
+        if len(parts) >= 4 and parts[0] == "BLOCK" and parts[2] == "Subsystem":
+            files.append(parts[3])
+    return files
+
+
+def netlist_hash(filename, parameter_values={}):
+
+    """
+    returns the hash of a simulation file, the contents of all
+    subsystem files it references (recursively) and the
+    parameter values that override the file
+
+    INPUTS:
+        filename         : path to file
+        parameter_values : (dict) values that override the PARAMETER lines
+    """
+
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+
+    values = sorted((name, np.asarray(value).tolist()) for name, value in parameter_values.items())
+    digest.update(pickle.dumps(values))
+
+    pending, seen = [filename], set()
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        with open(name, "rb") as file:
+            content = file.read()
+        digest.update(name.encode() + b"\0" + content + b"\0")
+        pending.extend(subsystem_files(content))
+
+    return digest.hexdigest()
+
+
+# CLASSES ===================================================================
+
+class NetlistCache:
+
+    """
+    on-disk cache of loaded simulation files, the connected and 
+    sorted blocks (see 'Simulation.get_graph'), connections, 
+    parameters, equations and time of a file are stored in binary 
+    (pickle) form under the hash of the file and all files it 
+    references, so changed files are parsed again automatically, 
+    the least recently used entries are removed when the total 
+    size of the cache exceeds 'max_size'
+    """
+
+    def __init__(self, directory=None, max_size=64*2**20):
+
+        """
+        INPUTS:
+            directory : path of the cache files, defaults to '~/.cache/analog_simulation'
+            max_size  : (int) maximum total size of the cache files [bytes]
+        """
+
+        self.directory = DEFAULT_DIRECTORY if directory is None else directory
+        self.max_size  = max_size
+
+        #statistics of the lookups
+        self.hits   = 0
+        self.misses = 0
+
+        #total size of the cache files, counted up from one scan of the
+        #directory (other processes are only seen at the next scan)
+        self.size = None
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _entries(self):
+        """
+        cache files as (last use, size, path), oldest first
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def _prune(self):
+        """
+        remove the least recently used entries until the cache 
+        fits into 3/4 of 'max_size', so the directory is only 
+        scanned again after a quarter of 'max_size' was written
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= 0.75 * self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.size = total
+
+    def _read(self, path):
+        """
+        returns the entry of a cache file or None
+        (unreadable entries are parsed again and replaced)
+        """
+        try:
+            with open(path, "rb") as file:
+                entry = pickle.load(file)
+            os.utime(path)
+            return entry
+        except Exception:
+            return None
+
+    def _write(self, path, entry):
+        """
+        add an entry to the cache and prune it if it 
+        exceeds 'max_size' (by the counted size)
+        """
+        #write to a temporary file first, so readers never see partial entries
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self._entries())
+        else:
+            self.size += os.path.getsize(path)
+
+        if self.size > self.max_size:
+            self._prune()
+
+    def load_simulation(self, filename, engine="object", parameter_values={}, netlists=None, **kwargs):
+
+        """
+        returns the Simulation of a file with the connected and 
+        sorted blocks from the cache, or loads the file and adds 
+        its blocks to the cache (see 'load_simulation_from_file')
+
+        INPUTS:
+            filename         : path to file
+            engine           : (str) simulation engine
+            parameter_values : (dict) values that override the PARAMETER lines
+            netlists         : (dict) cache of already read files (for parsing)
+            kwargs           : further arguments of the Simulation
+        """
+
+        path = self._path(netlist_hash(filename, parameter_values))
+
+        entry = self._read(path)
+        if entry is not None:
+            self.hits += 1
+            connections, parameters, equations, settings, graph = entry
+            return Simulation(graph["blocks"], connections, parameters, equations, 
+                              engine=engine, graph=graph, **settings, **kwargs)
+
+        blocks, connections, parameters, equations, dt, time = parse_simulation_file(filename, parameter_values, netlists)
+        self.misses += 1
+
+        settings = {} if time is None or dt is None else {"dt": dt, "time": time}
+        simulation = Simulation(blocks, connections, parameters, equations, engine=engine, **settings, **kwargs)
+
+        #the blocks are saved before the first step
+        self._write(path, (connections, parameters, equations, settings, simulation.get_graph()))
+
+        return simulation
+
+    def clear(self):
+        """
+        remove all entries of the cache
+        """
+        for _, _, path in self._entries():
+            os.remove(path)
+        self.size = 0
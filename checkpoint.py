@@ -0,0 +1,82 @@
+#############################################################################
+##
+##                   CHECKPOINTS OF SIMULATIONS (checkpoint.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import pickle
+
+
+# CLASSES ===================================================================
+
+class Checkpoint:
+
+    """
+    complete state of a simulation at one point in time, created
+    by 'Simulation.checkpoint' and restored by 'Simulation.restore',
+    the blocks are identified by their position, id and type
+    """
+
+    def __init__(self, time, dt, blocks, states, solver=None, linear_time=None, loop_history=None, rate_ticks=None, 
+                 event_step_end=None):
+
+        """
+        INPUTS:
+            time         : (float) simulation time
+            dt           : (float) timestep
+            blocks       : (list) (id, type name) of the blocks in evaluation order
+            states       : (list) full states of the blocks ('Block.get_full_state')
+            solver       : (object) copy of the global solver with its history
+            linear_time  : (float) time of the last step of the exact linear mode
+            loop_history : (list) loop outputs of the last steps for the predictor
+            rate_ticks   : (dict) last tick of every sample time as (count, time)
+            event_step_end : (float) end of the step that was shortened by an event
+        """
+
+        self.time        = time
+        self.dt          = dt
+        self.blocks      = blocks
+        self.states      = states
+        self.solver      = solver
+        self.linear_time = linear_time
+        self.loop_history = [] if loop_history is None else loop_history
+        self.rate_ticks   = {} if rate_ticks is None else rate_ticks
+        self.event_step_end = event_step_end
+
+
+# FUNCS =====================================================================
+
+def write_checkpoint(checkpoint, filename):
+
+    """
+    write a checkpoint to a binary file
+
+    INPUTS:
+        checkpoint : (Checkpoint) state of a simulation
+        filename   : path to file
+    """
+
+    with open(filename, "wb") as file:
+        pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_checkpoint(filename):
+
+    """
+    read a checkpoint from a file written by 'write_checkpoint'
+
+    INPUTS:
+        filename : path to file
+    """
+
+    with open(filename, "rb") as file:
+        checkpoint = pickle.load(file)
+
+    if not isinstance(checkpoint, Checkpoint):
+        raise ValueError(f"{filename} is not a checkpoint")
+
+    return checkpoint
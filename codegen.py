@@ -0,0 +1,275 @@
+#############################################################################
+##
+##                  CODE GENERATION BACKEND (codegen.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import ast
+
+from blocks import *
+from expressions import NAMESPACE
+
+
+# GLOBALS ===================================================================
+
+#shared cache of compiled simulation functions, keyed by their source
+_compiled_functions = {}
+
+#shared cache of generated sources, keyed by the signature of the netlist
+_generated_sources = {}
+
+
+# FUNCS =====================================================================
+
+def inline_expression(expression, argument):
+
+    """
+    returns the source of an expression with the
+    variable 'x' renamed to 'argument'
+
+    INPUTS:
+        expression : (str) expression of a Function or Generator block
+        argument   : (str) name of the variable that replaces 'x'
+    """
+
+    class Rename(ast.NodeTransformer):
+        def visit_Name(self, node):
+            if node.id == "x":
+                return ast.copy_location(ast.Name(id=argument, ctx=node.ctx), node)
+            return node
+
+    tree = Rename().visit(ast.parse(expression, mode="eval"))
+    return f"({ast.unparse(tree.body)})"
+
+
+def _inputs(block):
+
+    """
+    returns the input blocks of a block
+    and raises an error if there are none
+    """
+
+    if len(block.inputs) == 0:
+        raise ValueError(f"No input defined for block {block.label}_{block.id}")
+
+    return list(block.inputs.values())
+
+
+def _compute(block, y):
+
+    """
+    returns the source lines that compute one block
+
+    INPUTS:
+        block : (Block) block to compute
+        y     : (dict) names of the output variables of the blocks
+    """
+
+    name = y[block]
+
+    if isinstance(block, Amplifier):
+        return [f"{name} = {block.gain!r} * {y[_inputs(block)[0]]}"]
+
+    if isinstance(block, Inverter):
+        return [f"{name} = -1 * {y[_inputs(block)[0]]}"]
+
+    if isinstance(block, Scope):
+        return [f"{name} = {y[_inputs(block)[0]]}"]
+
+    if isinstance(block, Adder):
+        return [f"{name} = " + " + ".join(["0"] + [y[b] for b in _inputs(block)])]
+
+    if isinstance(block, Multiplier):
+        return [f"{name} = " + " * ".join(["1"] + [y[b] for b in _inputs(block)])]
+
+    if isinstance(block, Comparator):
+        return [f"{name} = 1 if {y[_inputs(block)[0]]} >= {block.threshold!r} else 0"]
+
+    if isinstance(block, (Function, LookupTable)) and block.table is not None:
+        return [f"{name} = f{name}({y[_inputs(block)[0]]})"]
+
+    if isinstance(block, Function):
+        return [f"{name} = {inline_expression(block.expression, y[_inputs(block)[0]])}"]
+
+    if isinstance(block, Generator):
+        return [f"{name} = {inline_expression(block.expression, 'time')}"]
+
+    if isinstance(block, Constant):
+        return []
+
+    if isinstance(block, Integrator):
+        u = y[_inputs(block)[0]]
+        return [f"if p{name} is None:",
+                f"    t{name} = {name} + {u} * dt",
+                f"else:",
+                f"    t{name} = {name} + ({u} + p{name}) * dt / 2"]
+
+    if isinstance(block, Differentiator):
+        u = y[_inputs(block)[0]]
+        return [f"if p{name} is not None:",
+                f"    t{name} = ({u} - p{name}) / dt"]
+
+    raise ValueError(f"Block {block.label}_{block.id} of type '{type(block).__name__}' is not supported by the code generation")
+
+
+def _signature(block, position):
+
+    """
+    returns what the generated source of a block depends on,
+    its type, parameters and the positions of its input blocks
+
+    INPUTS:
+        block    : (Block) block of the simulation
+        position : (dict) positions of the blocks
+    """
+
+    parameters = tuple(repr(getattr(block, name, None)) for name in ("gain", "threshold", "expression"))
+    return (type(block), 
+            parameters, 
+            getattr(block, "table", None) is not None, 
+            tuple(position[b] for b in block.inputs.values()))
+
+
+def generate_source(blocks, schedule, probes=[], update_order=None):
+
+    """
+    generate the source of a python function 'simulate' that
+    performs the timesteps of 'Simulation.update' for the given
+    blocks with local variables for all outputs and the block
+    arithmetic inlined, algebraic loops are resolved by
+    fixed-point iteration
+
+    the function loads the outputs and internal states from
+    the blocks, steps until 'max_steps' or 'duration' is reached,
+    records the probes of every 'decimation'-th step into
+    'times' and 'data' (if not None) and writes the outputs
+    and states back to the blocks
+
+    INPUTS:
+        blocks       : (list) sorted blocks of the simulation
+        schedule     : (list) (blocks, is_loop) groups in evaluation order
+        probes       : (list) blocks that are recorded
+        update_order : (list) order of the blocks for 'update_output' 
+                       (see 'Simulation._update_order'), default sorted order
+    """
+
+    position = {block: i for i, block in enumerate(blocks)}
+
+    #identical netlists (e.g. new simulations of the same file) share the source
+    key = (tuple(_signature(block, position) for block in blocks),
+           tuple((tuple(position[b] for b in group), is_loop) for group, is_loop in schedule),
+           tuple(position[b] for b in probes),
+           None if update_order is None else tuple(position[b] for b in update_order))
+
+    if key in _generated_sources:
+        return _generated_sources[key]
+
+    y = {block: f"y{i}" for i, block in enumerate(blocks)}
+    stateful = [block for block in blocks if isinstance(block, (Integrator, Differentiator))]
+    tables = [block for block in blocks if isinstance(block, (Function, LookupTable)) and block.table is not None]
+
+    lines = ["def simulate(blocks, time, start_time, duration, dt, max_iterations, tolerance, "
+             "max_steps, decimation, step, times, data, sample):",
+             "",
+             "    #load outputs and internal states"]
+
+    for i, block in enumerate(blocks):
+        lines.append(f"    {y[block]} = blocks[{i}].output")
+    for block in stateful:
+        i = position[block]
+        lines.append(f"    t{y[block]} = blocks[{i}].temp_output")
+        lines.append(f"    p{y[block]} = blocks[{i}].prev_input")
+    for block in tables:
+        lines.append(f"    f{y[block]} = blocks[{position[block]}].table.scalar")
+
+    lines += ["",
+              "    n = 0",
+              "    while n < max_steps and time - start_time < duration:",
+              "",
+              "        time += dt",
+              "        n += 1",
+              "        steady_state = True",
+              ""]
+
+    #compute the blocks in the order of the schedule
+    for group, is_loop in schedule:
+
+        if not is_loop:
+            for block in group:
+                lines += ["        " + line for line in _compute(block, y)]
+            continue
+
+        lines.append("        for iteration in range(max_iterations):")
+        lines.append("            " + "; ".join(f"o{y[block]} = {y[block]}" for block in group))
+        for block in group:
+            lines += ["            " + line for line in _compute(block, y)]
+        lines.append("            error = 0")
+        for block in group:
+            lines.append(f"            error = max(error, abs({y[block]} - o{y[block]}) / (1 + abs({y[block]})))")
+        lines += ["            if error < tolerance:",
+                  "                break",
+                  "        else:",
+                  "            steady_state = False"]
+
+    #update the outputs in the update order
+    if update_order is not None:
+        stateful = [block for block in update_order if isinstance(block, (Integrator, Differentiator))]
+
+    lines.append("")
+    for block in stateful:
+        lines.append(f"        p{y[block]} = {y[_inputs(block)[0]]}")
+        lines.append(f"        {y[block]} = t{y[block]}")
+
+    lines += ["",
+              "        if not steady_state:",
+              "            print(f\"Steady state not reached!\")",
+              "",
+              "        step += 1",
+              "        if times is not None and step % decimation == 0:",
+              "            times[sample] = time"]
+
+    for k, block in enumerate(probes):
+        lines.append(f"            data[{k}, sample] = {y[block]}")
+
+    lines += ["            sample += 1",
+              "            if sample == len(times):",
+              "                break",
+              "",
+              "    #store outputs and internal states"]
+
+    for i, block in enumerate(blocks):
+        lines.append(f"    blocks[{i}].output = {y[block]}")
+    for block in stateful:
+        i = position[block]
+        lines.append(f"    blocks[{i}].temp_output = t{y[block]}")
+        lines.append(f"    blocks[{i}].prev_input = p{y[block]}")
+
+    lines += ["",
+              "    return time, step, sample",
+              ""]
+
+    _generated_sources[key] = "\n".join(lines)
+
+    return _generated_sources[key]
+
+
+def compile_source(source):
+
+    """
+    compile the generated source into the 'simulate' function
+    with the math namespace, identical sources are compiled once
+
+    INPUTS:
+        source : (str) source from 'generate_source'
+    """
+
+    if source not in _compiled_functions:
+        namespace = dict(NAMESPACE)
+        exec(compile(source, "<generated simulation>", "exec"), namespace)
+        _compiled_functions[source] = namespace["simulate"]
+
+    return _compiled_functions[source]
@@ -0,0 +1,374 @@
+#############################################################################
+##
+##                     ARRAY SIMULATION ENGINE (engine.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+from itertools import chain
+
+import numpy as np
+
+from blocks import *
+from expressions import compile_expression
+from loops import deviation
+
+
+# CLASSES ===================================================================
+
+class ArrayEngine:
+
+    """
+    alternative simulation engine that compiles the sorted
+    block graph into flat numpy arrays (output vector, state
+    vectors, connection index arrays) and advances a whole
+    timestep with a handful of vectorized operations
+
+    the memoryless blocks are grouped into levels, where each
+    level only depends on the levels before it, so one sweep
+    over the levels is exact for graphs without algebraic loops,
+    graphs with algebraic loops are solved by repeated sweeps
+    (fixed-point iteration) as in 'Simulation.update'
+
+    in batched mode every block output is a vector of length
+    'batch_size' that holds one value per parameter variant,
+    so all variants are advanced in lockstep
+    """
+
+    def __init__(self, blocks, batch_size=None, update_order=None):
+
+        """
+        compile the blocks into arrays
+
+        INPUTS:
+            blocks       : (list) sorted list of Block objects
+            batch_size   : (int) number of parameter variants or None
+            update_order : (list) order of the blocks for 'update_output' 
+                           (see 'Simulation._update_order'), default sorted order
+        """
+
+        self.blocks     = blocks
+        self.index      = {block: i for i, block in enumerate(blocks)}
+        self.batch_size = batch_size
+
+        #shape of the global output array (blocks x variants)
+        self.shape = (len(blocks),) if batch_size is None else (len(blocks), batch_size)
+
+        #convergence of the fixed-point iteration for each variant
+        self.steady_state = np.ones(self.shape[1:], dtype=bool)
+
+        #blocks with internal states
+        self.integrators     = self._indices(Integrator)
+        self.differentiators = self._indices(Differentiator)
+
+        self.integrator_inputs     = self._input_indices(self.integrators)
+        self.differentiator_inputs = self._input_indices(self.differentiators)
+
+        #the blocks update their outputs one after another, so a state block
+        #that is fed by a state block earlier in the update order sees its new output
+        self.update_rank = {block: k for k, block in enumerate(blocks if update_order is None else update_order)}
+        self.integrator_sees_update     = self._sees_update(self.integrators, self.integrator_inputs)
+        self.differentiator_sees_update = self._sees_update(self.differentiators, self.differentiator_inputs)
+
+        #sources that are evaluated once per timestep
+        self.generators = [(i, blocks[i].func) for i in self._indices(Generator)]
+
+        #schedule of the memoryless blocks
+        self.schedule, self.has_loops = self._build_schedule()
+
+        #get initial values from the blocks
+        self.load()
+
+
+    def _indices(self, block_type):
+        return np.array([i for i, block in enumerate(self.blocks)
+                         if type(block) is block_type], dtype=int)
+
+
+    def _input_indices(self, indices):
+        return np.array([self.index[self._inputs(self.blocks[i])[0]]
+                         for i in indices], dtype=int)
+
+
+    def _sees_update(self, indices, inputs):
+        rank = self.update_rank
+        return self._values([type(self.blocks[j]) in (Integrator, Differentiator) 
+                             and rank[self.blocks[j]] < rank[self.blocks[i]]
+                             for i, j in zip(indices, inputs)], dtype=bool)
+
+
+    def _values(self, values, dtype=float):
+
+        """
+        stack scalar or per variant values of multiple blocks into
+        an array that broadcasts against the selected outputs,
+        missing values (None) are represented by NaN
+        """
+
+        shape = self.shape[1:]
+        values = [np.broadcast_to(np.nan if v is None else v, shape) for v in values]
+        return np.array(values, dtype=dtype).reshape((len(values),) + shape)
+
+
+    def _inputs(self, block):
+
+        """
+        returns the input blocks of a block
+        and raises an error if there are none
+        """
+
+        if len(block.inputs) == 0:
+            raise ValueError(f"No input defined for block {block.label}_{block.id}")
+
+        return list(block.inputs.values())
+
+
+    def _build_schedule(self):
+
+        """
+        assign levels to the memoryless blocks (longest path from the
+        sources or states) and group them by level and block type
+        into vectorized operations
+        """
+
+        memoryless = (Amplifier, Inverter, Scope, Adder, Multiplier, Comparator, Function, LookupTable)
+        sources    = (Integrator, Differentiator, Constant, Generator)
+
+        algebraic = []
+        for block in self.blocks:
+            if type(block) in memoryless:
+                algebraic.append(block)
+            elif type(block) not in sources:
+                raise ValueError(f"Block {block.label}_{block.id} of type '{type(block).__name__}' is not supported by the array engine")
+
+        #dependencies between the memoryless blocks (kahn's algorithm)
+        members = set(algebraic)
+        dependencies = {block: [b for b in self._inputs(block) if b in members] for block in algebraic}
+        dependents   = {block: [] for block in algebraic}
+        for block, inputs in dependencies.items():
+            for b in inputs:
+                dependents[b].append(block)
+
+        levels = {}
+        missing = {block: len(inputs) for block, inputs in dependencies.items()}
+        ready = [block for block in algebraic if missing[block] == 0]
+        while ready:
+            block = ready.pop()
+            levels[block] = 1 + max((levels[b] for b in dependencies[block]), default=0)
+            for b in dependents[block]:
+                missing[b] -= 1
+                if missing[b] == 0:
+                    ready.append(b)
+
+        #remaining blocks are part of or depend on algebraic loops
+        has_loops = len(levels) < len(algebraic)
+        for block in algebraic:
+            if block not in levels:
+                levels[block] = 1 + max((levels.get(b, 0) for b in dependencies[block]), default=0)
+
+        #blocks of every level in their sorted order
+        level_blocks = {}
+        for block in algebraic:
+            level_blocks.setdefault(levels[block], []).append(block)
+
+        #group the blocks of every level by operation
+        schedule = []
+        for level in sorted(level_blocks):
+
+            blocks = level_blocks[level]
+
+            gains = [block for block in blocks if isinstance(block, (Amplifier, Inverter, Scope))]
+            if gains:
+                schedule.append(("gain",
+                                 self._array(gains),
+                                 np.array([self.index[self._inputs(b)[0]] for b in gains], dtype=int),
+                                 self._values([b.gain if isinstance(b, Amplifier) else -1.0 if isinstance(b, Inverter) else 1.0
+                                               for b in gains])))
+
+            for kind, block_type in [("add", Adder), ("multiply", Multiplier)]:
+                reducers = [block for block in blocks if isinstance(block, block_type)]
+                if reducers:
+                    inputs = [[self.index[b] for b in self._inputs(block)] for block in reducers]
+                    starts = np.cumsum([0] + [len(i) for i in inputs[:-1]])
+                    schedule.append((kind,
+                                     self._array(reducers),
+                                     np.fromiter(chain.from_iterable(inputs), dtype=int),
+                                     starts))
+
+            comparators = [block for block in blocks if isinstance(block, Comparator)]
+            if comparators:
+                schedule.append(("compare",
+                                 self._array(comparators),
+                                 np.array([self.index[self._inputs(b)[0]] for b in comparators], dtype=int),
+                                 self._values([b.threshold for b in comparators])))
+
+            functions = [block for block in blocks if isinstance(block, (Function, LookupTable))]
+            if functions:
+                schedule.append(("function",
+                                 None,
+                                 None,
+                                 [(self.index[b], self.index[self._inputs(b)[0]], self._function(b))
+                                  for b in functions]))
+
+        return schedule, has_loops
+
+
+    def _function(self, block):
+
+        """
+        returns the function of a Function or LookupTable block, 
+        tables accept arrays, expressions are compiled for arrays 
+        in batched mode
+        """
+
+        if block.table is not None:
+            return block.table
+
+        return compile_expression(block.expression, vectorized=True) if self.batch_size else block.func
+
+
+    def _array(self, blocks):
+        return np.array([self.index[block] for block in blocks], dtype=int)
+
+
+    def load(self):
+
+        """
+        read the outputs and internal states from the block objects
+        """
+
+        self.outputs = self._values([block.output for block in self.blocks])
+
+        self.integrator_prev     = self._values([self.blocks[i].prev_input for i in self.integrators])
+        self.differentiator_prev = self._values([self.blocks[i].prev_input for i in self.differentiators])
+        self.differentiator_temp = self._values([self.blocks[i].temp_output for i in self.differentiators])
+
+
+    def sync(self):
+
+        """
+        write the outputs and internal states back to the block objects
+        """
+
+        for block, value in zip(self.blocks, self._unpack(self.outputs)):
+            block.output = value
+
+        for i, prev in zip(self.integrators, self._unpack(self.integrator_prev)):
+            self.blocks[i].temp_output = self.blocks[i].output
+            self.blocks[i].prev_input = prev
+
+        for i, prev, temp in zip(self.differentiators, self._unpack(self.differentiator_prev), self._unpack(self.differentiator_temp)):
+            self.blocks[i].temp_output = temp
+            self.blocks[i].prev_input = prev
+
+
+    def _unpack(self, values):
+
+        """
+        split an array into the values of the individual blocks
+        (floats or per variant arrays), NaN is converted to None
+        """
+
+        if self.batch_size is None:
+            return [None if np.isnan(v) else v for v in values.tolist()]
+
+        return [None if np.all(np.isnan(v)) else v.copy() for v in values]
+
+
+    def sweep(self):
+
+        """
+        evaluate all memoryless blocks once in the order of their levels
+        """
+
+        y = self.outputs
+
+        for kind, indices, inputs, extra in self.schedule:
+
+            if kind == "gain":
+                y[indices] = extra * y[inputs]
+
+            elif kind == "add":
+                y[indices] = np.add.reduceat(y[inputs], extra)
+
+            elif kind == "multiply":
+                y[indices] = np.multiply.reduceat(y[inputs], extra)
+
+            elif kind == "compare":
+                y[indices] = y[inputs] >= extra
+
+            else:
+                for i, j, func in extra:
+                    y[i] = func(y[j])
+
+
+    def update(self, time, dt, max_iterations=20, tolerance=1e-6, debug=False):
+
+        """
+        perform one update of the outputs and states at 'time'
+
+        INPUTS:
+            time           : (float) simulation time after the update
+            dt             : (float) timestep
+            max_iterations : (int) maximum number of fixed-point iterations
+            tolerance      : (float) tolerance for convergence of fixed-point iterations
+            debug          : (bool) print debugging info (convergence etc.)
+        """
+
+        y = self.outputs
+
+        #evaluate the sources
+        for i, func in self.generators:
+            y[i] = func(time)
+
+        #perform fixed-point iterations over the levels
+        for iteration in range(max_iterations):
+
+            #save previous outputs for convergence checking
+            prev_outputs = y.copy()
+
+            self.sweep()
+
+            #one sweep is exact without algebraic loops
+            if not self.has_loops:
+                self.steady_state[...] = True
+                break
+
+            #compute combined absolute and relative deviation (for each variant)
+            max_errors = deviation(y, prev_outputs).max(axis=0, initial=0)
+
+            if debug:
+                print("        iteration  :", iteration+1)
+                print("        difference :", max_errors)
+
+            #check for convergence of all variants
+            self.steady_state = max_errors < tolerance
+            if np.all(self.steady_state):
+                break
+
+        #update the integrators (forward euler for the first step, then trapezoidal)
+        u_int = y[self.integrator_inputs]
+        x = y[self.integrators]
+        y[self.integrators] = np.where(np.isnan(self.integrator_prev),
+                                       x + u_int * dt,
+                                       x + (u_int + self.integrator_prev) * dt / 2)
+
+        #update the differentiators
+        u_diff = y[self.differentiator_inputs]
+        self.differentiator_temp = np.where(np.isnan(self.differentiator_prev),
+                                            self.differentiator_temp,
+                                            (u_diff - self.differentiator_prev) / dt)
+        y[self.differentiators] = self.differentiator_temp
+
+        #save the inputs for the next step
+        self.integrator_prev = np.where(self.integrator_sees_update, y[self.integrator_inputs], u_int)
+        self.differentiator_prev = np.where(self.differentiator_sees_update, y[self.differentiator_inputs], u_diff)
+
+        if self.batch_size is None and not self.steady_state:
+            print(f"Steady state not reached!")
+
+        elif not np.all(self.steady_state):
+            print(f"Steady state not reached for {np.count_nonzero(~self.steady_state)} of {self.batch_size} variants!")
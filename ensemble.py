@@ -0,0 +1,227 @@
+#############################################################################
+##
+##                     ENSEMBLE SIMULATIONS (ensemble.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import os
+import traceback
+
+from math import ceil
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from parsers import read_simulation_file, load_simulation_from_file
+
+
+# GLOBALS ===================================================================
+
+#state of the worker processes (set by '_initialize_worker')
+_worker = {}
+
+
+# CLASSES ===================================================================
+
+class Job:
+
+    """
+    single simulation of an ensemble, defined by a simulation
+    file and parameter values that override the file
+    """
+
+    def __init__(self, filename, parameter_values={}):
+
+        self.filename         = filename
+        self.parameter_values = parameter_values
+
+
+class EnsembleResult:
+
+    """
+    results of an ensemble run, the time series of the scopes
+    of job 'i' are 'data[i, :, :steps[i]]' with the time
+    vector 'time[i, :steps[i]]' and the scope labels 'labels[i]',
+    failed jobs have an error message in 'errors[i]'
+    """
+
+    def __init__(self, time, data, steps, labels, errors):
+
+        self.time   = time
+        self.data   = data
+        self.steps  = steps
+        self.labels = labels
+        self.errors = errors
+
+    @property
+    def failed(self):
+        """
+        indices of the jobs that raised an error
+        """
+        return [i for i, error in enumerate(self.errors) if error is not None]
+
+    def get_job(self, i):
+        """
+        returns time vector and scope data of a single job
+        """
+        return self.time[i, :self.steps[i]], self.data[i, :len(self.labels[i]), :self.steps[i]]
+
+
+# FUNCS =====================================================================
+
+def _attach(name, shape):
+    """
+    open an existing shared memory block as numpy array
+    """
+    memory = SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype=float, buffer=memory.buf)
+
+
+def _initialize_worker(time_name, data_name, shape):
+
+    """
+    attach the worker process to the shared result buffers
+    """
+
+    _worker["time"] = _attach(time_name, shape[::2])
+    _worker["data"] = _attach(data_name, shape)
+
+    #cache of the read simulation files of this worker
+    _worker["netlists"] = {}
+
+
+def _run_job(args):
+
+    """
+    run a single job in the worker process and write the
+    recorded scope outputs into the shared result buffers,
+    returns the job index, number of recorded steps, scope
+    labels and the error message if the job failed
+    """
+
+    index, job, duration, engine, max_iterations, tolerance = args
+
+    _, time = _worker["time"]
+    _, data = _worker["data"]
+
+    try:
+
+        sim = load_simulation_from_file(job.filename, engine, job.parameter_values, _worker["netlists"])
+
+        if sim.batch_size is not None:
+            raise ValueError("Vector parameters are not supported in ensembles, use a batched simulation instead")
+
+        #scopes in the order of the file
+        block_lines, *_ = _worker["netlists"][job.filename]
+        scopes = [sim.get_block(block_id) for block_id, block_type, *_ in block_lines if block_type == "Scope"]
+
+        if len(scopes) > data.shape[1]:
+            raise ValueError(f"Job has {len(scopes)} scopes, the result buffer only {data.shape[1]}")
+
+        #outputs are read from the array engine if available
+        if sim.array_engine is not None:
+            scope_indices = [sim.blocks.index(scope) for scope in scopes]
+
+        start_time, step = sim.time, 0
+
+        while sim.time - start_time < duration:
+
+            if step == data.shape[2]:
+                raise ValueError("Number of timesteps exceeds the result buffer")
+
+            sim.update(max_iterations, tolerance)
+
+            time[index, step] = sim.time
+            if sim.array_engine is None:
+                data[index, :len(scopes), step] = [scope.output for scope in scopes]
+            else:
+                data[index, :len(scopes), step] = sim.array_engine.outputs[scope_indices]
+
+            step += 1
+
+        return index, step, [scope.label for scope in scopes], None
+
+    except Exception:
+        return index, 0, [], traceback.format_exc()
+
+
+def run_ensemble(jobs, duration=10, engine="object", max_iterations=100, tolerance=1e-6, processes=None, progress=None):
+
+    """
+    run multiple simulations on a pool of worker processes,
+    every worker reads each simulation file only once and
+    writes the scope outputs directly into shared memory,
+    the results are ordered like the jobs and a failing
+    job does not affect the others
+
+    INPUTS:
+        jobs           : (list) Job objects or filenames
+        duration       : (float) simulation time of every job [s]
+        engine         : (str) simulation engine, 'object' or 'array'
+        max_iterations : (int) maximum number of fixed-point iterations
+        tolerance      : (float) tolerance for convergence of fixed-point iterations
+        processes      : (int) number of worker processes, defaults to all cores
+        progress       : (callable) called with (finished jobs, total jobs)
+                         after every finished job
+    """
+
+    jobs = [job if isinstance(job, Job) else Job(job) for job in jobs]
+
+    #size of the result buffers from the files (scopes and timesteps)
+    max_scopes, max_steps = 0, 0
+    for filename in {job.filename for job in jobs}:
+        try:
+            block_lines, _, _, _, dt, _ = read_simulation_file(filename)
+        except Exception:
+            continue
+        max_scopes = max(max_scopes, sum(block_type == "Scope" for _, block_type, *_ in block_lines))
+        max_steps = max(max_steps, ceil(duration / (0.01 if dt is None else dt)) + 1)
+
+    shape = (len(jobs), max_scopes, max_steps)
+
+    #shared result buffers (at least one byte each)
+    time_memory = SharedMemory(create=True, size=max(8 * shape[0] * shape[2], 1))
+    data_memory = SharedMemory(create=True, size=max(8 * shape[0] * shape[1] * shape[2], 1))
+
+    time, data = None, None
+
+    try:
+
+        time = np.ndarray(shape[::2], dtype=float, buffer=time_memory.buf)
+        data = np.ndarray(shape, dtype=float, buffer=data_memory.buf)
+        time[:] = np.nan
+        data[:] = np.nan
+
+        steps  = np.zeros(len(jobs), dtype=int)
+        labels = [[] for _ in jobs]
+        errors = [None for _ in jobs]
+
+        tasks = [(i, job, duration, engine, max_iterations, tolerance) for i, job in enumerate(jobs)]
+
+        with Pool(processes or os.cpu_count(),
+                  initializer=_initialize_worker,
+                  initargs=(time_memory.name, data_memory.name, shape)) as pool:
+
+            for finished, (i, n, job_labels, error) in enumerate(pool.imap_unordered(_run_job, tasks), 1):
+
+                steps[i], labels[i], errors[i] = n, job_labels, error
+
+                if progress is not None:
+                    progress(finished, len(jobs))
+
+        #copy out of the shared memory before releasing it
+        result = EnsembleResult(time.copy(), data.copy(), steps, labels, errors)
+
+    finally:
+        del time, data
+        time_memory.close()
+        time_memory.unlink()
+        data_memory.close()
+        data_memory.unlink()
+
+    return result
@@ -0,0 +1,87 @@
+#############################################################################
+##
+##                  EXPRESSION COMPILER (expressions.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import math
+
+import numpy as np
+
+
+# GLOBALS ===================================================================
+
+#namespace that is bound to every compiled expression
+NAMESPACE = {name: getattr(math, name) for name in dir(math) if not name.startswith("_")}
+
+#numpy functions whose names differ from the math module
+NUMPY_NAMES = {
+    "asin"  : "arcsin",
+    "acos"  : "arccos",
+    "atan"  : "arctan",
+    "atan2" : "arctan2",
+    "asinh" : "arcsinh",
+    "acosh" : "arccosh",
+    "atanh" : "arctanh",
+    "pow"   : "power",
+}
+
+#namespace for expressions that are evaluated on arrays
+NAMESPACE_VECTORIZED = {name: getattr(np, NUMPY_NAMES.get(name, name), value) 
+                        for name, value in NAMESPACE.items()}
+
+#shared cache of compiled expressions, keyed by expression text and arguments
+_compiled_expressions = {}
+
+
+# FUNCS =====================================================================
+
+def compile_expression(expression, arguments=("x",), vectorized=False):
+
+    """
+    compile an expression string into a python function of the
+    given arguments with the math namespace bound up front,
+    identical expressions share one compiled function
+
+    INPUTS:
+        expression : (str) expression to compile, e.g. 'sin(x)'
+        arguments  : (tuple) names of the function arguments
+        vectorized : (bool) bind numpy functions instead of the 
+                     math module so the function accepts arrays
+    """
+
+    key = (expression, tuple(arguments), vectorized)
+
+    if key not in _compiled_expressions:
+        source = f"lambda {', '.join(arguments)}: ({expression})"
+        code = compile(source, f"<expression '{expression}'>", "eval")
+        namespace = NAMESPACE_VECTORIZED if vectorized else NAMESPACE
+        _compiled_expressions[key] = eval(code, dict(namespace))
+
+    return _compiled_expressions[key]
+
+
+def expression_names(expression):
+
+    """
+    returns the names that are referenced by an expression,
+    names of the math namespace are included because parameters
+    with the same name (e.g. 'e', 'gamma') shadow them
+
+    INPUTS:
+        expression : (str) expression to analyze
+    """
+
+    code = compile(expression, f"<expression '{expression}'>", "eval")
+    return tuple(code.co_names)
+
+
+def clear_cache():
+    """
+    remove all compiled expressions from the shared cache
+    """
+    _compiled_expressions.clear()
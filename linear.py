@@ -0,0 +1,255 @@
+#############################################################################
+##
+##                 LINEAR SUB-NETWORKS OF THE DIAGRAM (linear.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import numpy as np
+
+from blocks import Integrator, Amplifier, Inverter, Adder
+
+
+# GLOBALS ===================================================================
+
+#blocks that form the linear sub-networks, all other
+#blocks (Constant, Function, Multiplier, ...) are inputs
+LINEAR_BLOCKS = (Integrator, Amplifier, Inverter, Adder)
+
+
+# FUNCS =====================================================================
+
+def expm(matrix):
+
+    """
+    matrix exponential by scaling and squaring with
+    a diagonal pade approximation of order 6
+
+    INPUTS:
+        matrix : (array) square matrix
+    """
+
+    matrix = np.asarray(matrix, dtype=float)
+    identity = np.eye(len(matrix))
+
+    #scale the matrix to a norm below 1/2
+    norm = np.linalg.norm(matrix, np.inf)
+    squarings = max(0, int(np.ceil(np.log2(norm))) + 1) if norm > 0 else 0
+    scaled = matrix / 2**squarings
+
+    #pade approximation N/D of the scaled matrix
+    q, c = 6, 0.5
+    power = scaled
+    numerator = identity + c * power
+    denominator = identity - c * power
+    for k in range(2, q + 1):
+        c *= (q - k + 1) / (k * (2 * q - k + 1))
+        power = scaled @ power
+        numerator += c * power
+        denominator += (-1)**k * c * power
+
+    result = np.linalg.solve(denominator, numerator)
+
+    for _ in range(squarings):
+        result = result @ result
+
+    return result
+
+
+def zero_order_hold(A, B, dt):
+
+    """
+    exact discretization of x' = A x + B u for inputs that
+    are held constant over the timestep, returns the matrices
+    Ad, Bd of x[k+1] = Ad x[k] + Bd u[k]
+
+    INPUTS:
+        A  : (array) state matrix
+        B  : (array) input matrix
+        dt : (float) timestep
+    """
+
+    n, m = B.shape
+    augmented = np.zeros((n + m, n + m))
+    augmented[:n, :n] = A
+    augmented[:n, n:] = B
+
+    discrete = expm(augmented * dt)
+
+    return discrete[:n, :n], discrete[:n, n:]
+
+
+def find_linear_networks(blocks):
+
+    """
+    returns the maximal connected groups of linear blocks
+    that contain at least one integrator (in block order)
+
+    INPUTS:
+        blocks : (list) sorted blocks of the simulation
+    """
+
+    linear = [block for block in blocks if isinstance(block, LINEAR_BLOCKS)]
+
+    #union-find over the connections between linear blocks
+    parent = {block: block for block in linear}
+
+    def find(block):
+        while parent[block] is not block:
+            parent[block] = parent[parent[block]]
+            block = parent[block]
+        return block
+
+    for block in linear:
+        for input_block in block.inputs.values():
+            if input_block in parent:
+                parent[find(input_block)] = find(block)
+
+    groups = {}
+    for block in linear:
+        groups.setdefault(find(block), []).append(block)
+
+    return [group for group in groups.values()
+            if any(isinstance(block, Integrator) for block in group)]
+
+
+def state_space(integrators, outputs, inputs, jacobians):
+
+    """
+    returns the matrices A, B, C, D of the state-space model
+
+        x' = A x + B u
+        y  = C x + D u
+
+    with the outputs of the integrators as states 'x', the outputs 
+    of the input blocks as 'u' and the outputs of the other blocks 
+    as 'y', from the derivatives of the other blocks with respect 
+    to their input blocks, algebraic loops are solved exactly and 
+    all remaining blocks are constant
+
+    INPUTS:
+        integrators : (list) Integrator blocks (states)
+        outputs     : (list) blocks with feedthrough (outputs)
+        inputs      : (list) blocks whose outputs are the inputs
+        jacobians   : (list) (input_block, derivative) pairs for every output block
+    """
+
+    n, m, k = len(integrators), len(inputs), len(outputs)
+
+    state  = {block: i for i, block in enumerate(integrators)}
+    inputs = {block: i for i, block in enumerate(inputs)}
+    output = {block: i for i, block in enumerate(outputs)}
+
+    #outputs as y = M y + P x + Q u from the block derivatives
+    M, P, Q = np.zeros((k, k)), np.zeros((k, n)), np.zeros((k, m))
+    for i, derivatives in enumerate(jacobians):
+        for input_block, derivative in derivatives:
+            if input_block in output:
+                M[i, output[input_block]] += derivative
+            elif input_block in state:
+                P[i, state[input_block]] += derivative
+            elif input_block in inputs:
+                Q[i, inputs[input_block]] += derivative
+
+    try:
+        solution = np.linalg.solve(np.eye(k) - M, np.hstack([P, Q])) if k else np.zeros((0, n + m))
+    except np.linalg.LinAlgError:
+        raise ValueError("Algebraic loop of the linear blocks has no unique solution")
+
+    C, D = solution[:, :n], solution[:, n:]
+
+    #integrator inputs as rows of the state-space matrices
+    A, B = np.zeros((n, n)), np.zeros((n, m))
+    for i, block in enumerate(integrators):
+        input_block = block.inputs['input']
+        if input_block in output:
+            A[i] = C[output[input_block]]
+            B[i] = D[output[input_block]]
+        elif input_block in state:
+            A[i, state[input_block]] = 1.0
+        elif input_block in inputs:
+            B[i, inputs[input_block]] = 1.0
+
+    return A, B, C, D
+
+
+# CLASSES ===================================================================
+
+class LinearNetwork:
+
+    """
+    state-space model of a linear sub-network of the diagram
+
+        x' = A x + B u
+        y  = C x + D u
+
+    with the outputs of the integrators as states 'x', the outputs
+    of the blocks that feed into the network from outside as
+    inputs 'u' and the outputs of the other network blocks as 'y',
+    algebraic loops within the network are solved exactly
+    """
+
+    def __init__(self, blocks):
+
+        """
+        INPUTS:
+            blocks : (list) blocks of the network (see 'find_linear_networks')
+        """
+
+        self.blocks      = blocks
+        self.integrators = [block for block in blocks if isinstance(block, Integrator)]
+        self.outputs     = [block for block in blocks if not isinstance(block, Integrator)]
+
+        members = set(blocks)
+        self.inputs = []
+        for block in blocks:
+            if len(block.inputs) == 0:
+                raise ValueError(f"No input defined for block {block.label}_{block.id}")
+            for input_block in block.inputs.values():
+                if input_block not in members and input_block not in self.inputs:
+                    self.inputs.append(input_block)
+
+        self.A, self.B, self.C, self.D = state_space(self.integrators, self.outputs, self.inputs, 
+                                                     [block.jacobian() for block in self.outputs])
+
+        #discretization for the last timestep
+        self.dt = None
+        self.Ad, self.Bd = None, None
+
+    def advance(self, states, dt):
+
+        """
+        returns the states after one timestep with the
+        current outputs of the input blocks held constant
+
+        INPUTS:
+            states : (array) states of the integrators
+            dt     : (float) timestep
+        """
+
+        if dt != self.dt:
+            self.Ad, self.Bd = zero_order_hold(self.A, self.B, dt)
+            self.dt = dt
+
+        return self.Ad @ states + self.Bd @ self.input_values()
+
+    def input_values(self):
+        """
+        returns the current outputs of the input blocks
+        """
+        return np.array([block.output for block in self.inputs], dtype=float)
+
+    def output_values(self, states):
+
+        """
+        returns the outputs y = C x + D u of the other network 
+        blocks for the states and the current inputs
+
+        INPUTS:
+            states : (array) states of the integrators
+        """
+
+        return self.C @ states + self.D @ self.input_values()
@@ -0,0 +1,201 @@
+#############################################################################
+##
+##                   ALGEBRAIC LOOP SOLVERS (loops.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import numpy as np
+
+
+# FUNCS =====================================================================
+
+def deviation(output, prev_output):
+
+    """
+    combined absolute and relative deviation of an output from
+    its previous value, absolute for outputs near zero and
+    relative for large outputs
+
+    INPUTS:
+        output      : (float, array) new output
+        prev_output : (float, array) previous output
+    """
+
+    return abs(output - prev_output) / (1 + abs(output))
+
+
+def solve_fixed_point(blocks, time, dt, max_iterations=20, tolerance=1e-6, debug=False):
+
+    """
+    resolve an algebraic loop by fixed-point iteration
+    and return if the iteration converged
+
+    INPUTS:
+        blocks         : (list) blocks of the algebraic loop
+        time           : (float) simulation time
+        dt             : (float) timestep
+        max_iterations : (int) maximum numbver of fixed-point iterations
+        tolerance      : (float) tolerance for convergence of fixed-point iterations
+        debug          : (bool) print debugging info (convergence etc.)
+    """
+
+    for iteration in range(max_iterations):
+
+        #save previous outputs for convergence checking
+        prev_outputs = [block.output for block in blocks]
+
+        #update states of the loop blocks
+        for block in blocks:
+            block.compute(time, dt)
+
+        #compute combined absolute and relative deviation
+        max_errors = max([deviation(block.output, prev_output) 
+                          for block, prev_output in zip(blocks, prev_outputs)] + [0])
+
+        if debug:
+            print("        iteration  :", iteration+1)
+            print("        difference :", max_errors)
+
+        #check for convergence
+        if max_errors < tolerance:
+            return True
+
+    return False
+
+
+def evaluate_loop(blocks, x, time, dt):
+
+    """
+    evaluate every block of an algebraic loop once with
+    the loop outputs fixed to 'x' and return the computed
+    outputs g(x), the loop is solved by x = g(x)
+
+    INPUTS:
+        blocks : (list) blocks of the algebraic loop
+        x      : (array) outputs of the loop blocks
+        time   : (float) simulation time
+        dt     : (float) timestep
+    """
+
+    for block, value in zip(blocks, x):
+        block.output = value
+
+    g = np.empty(len(blocks))
+    for i, block in enumerate(blocks):
+        block.compute(time, dt)
+        g[i] = block.output
+        block.output = x[i]
+
+    return g
+
+
+def loop_jacobian(blocks, x, g, time, dt):
+
+    """
+    jacobian dg/dx of the loop evaluation at 'x', analytic
+    for blocks that provide their derivatives through
+    'Block.jacobian' and by finite differences otherwise
+
+    INPUTS:
+        blocks : (list) blocks of the algebraic loop
+        x      : (array) outputs of the loop blocks
+        g      : (array) loop evaluation g(x)
+        time   : (float) simulation time
+        dt     : (float) timestep
+    """
+
+    position = {block: i for i, block in enumerate(blocks)}
+    jacobian = np.zeros((len(blocks), len(blocks)))
+
+    for block, value in zip(blocks, x):
+        block.output = value
+
+    for i, block in enumerate(blocks):
+
+        derivatives = block.jacobian()
+
+        #analytically known derivatives
+        if derivatives is not None:
+            for input_block, derivative in derivatives:
+                if input_block in position:
+                    jacobian[i, position[input_block]] += derivative
+            continue
+
+        #forward differences with respect to the loop inputs
+        for j in {position[b] for b in block.inputs.values() if b in position}:
+            h = 1.49e-8 * max(1.0, abs(x[j]))
+            blocks[j].output = x[j] + h
+            block.compute(time, dt)
+            jacobian[i, j] = (block.output - g[i]) / h
+            blocks[j].output = x[j]
+
+        block.output = x[i]
+
+    return jacobian
+
+
+def solve_newton(blocks, time, dt, max_iterations=20, tolerance=1e-6, debug=False, broyden=False):
+
+    """
+    resolve an algebraic loop as F(x) = g(x) - x = 0 with newton's
+    method and return if the iteration converged, with 'broyden'
+    the jacobian is only computed once and then updated by
+    rank-one (broyden) updates
+
+    INPUTS:
+        blocks         : (list) blocks of the algebraic loop
+        time           : (float) simulation time
+        dt             : (float) timestep
+        max_iterations : (int) maximum numbver of newton iterations
+        tolerance      : (float) tolerance for convergence of the outputs
+        debug          : (bool) print debugging info (convergence etc.)
+        broyden        : (bool) use broyden updates instead of new jacobians
+    """
+
+    x = np.array([block.output for block in blocks], dtype=float)
+    g = evaluate_loop(blocks, x, time, dt)
+    residual = g - x
+
+    identity = np.eye(len(blocks))
+
+    for iteration in range(max_iterations):
+
+        if iteration == 0 or not broyden:
+            jacobian = loop_jacobian(blocks, x, g, time, dt) - identity
+
+        try:
+            dx = np.linalg.solve(jacobian, -residual)
+        except np.linalg.LinAlgError:
+            return False
+
+        x = x + dx
+        g = evaluate_loop(blocks, x, time, dt)
+        new_residual = g - x
+
+        if not np.all(np.isfinite(g)):
+            return False
+
+        #compute combined absolute and relative deviation
+        max_errors = deviation(g, x).max(initial=0)
+
+        if debug:
+            print("        iteration  :", iteration+1)
+            print("        difference :", max_errors)
+
+        #check for convergence
+        if max_errors < tolerance:
+            for block, value in zip(blocks, g):
+                block.output = value
+            return True
+
+        #rank-one update of the jacobian
+        if broyden:
+            jacobian += np.outer(new_residual - residual - jacobian @ dx, dx) / np.dot(dx, dx)
+
+        residual = new_residual
+
+    return False
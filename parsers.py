@@ -14,38 +14,20 @@ from simulation import *
 
 # FUNCS =====================================================================
 
-def parse_simulation_file(filename):
+def read_simulation_file(filename):
 
     """
-    load simulation blocks, connections and state 
-    from .txt file and returns blocks, connections 
-    and time if available
+    read the lines of a simulation .txt file and sort 
+    them by their prefixes, returns the split lines 
+    of the blocks, connections, parameters, equations 
+    and the time if available
 
     INPUTS:
         filename : path to file
     """
 
-    block_types = {
-        "Amplifier"      : Amplifier,
-        "Integrator"     : Integrator,
-        "Comparator"     : Comparator,
-        "Adder"          : Adder,
-        "Multiplier"     : Multiplier,
-        "Constant"       : Constant,
-        "Inverter"       : Inverter,
-        "Generator"      : Generator,
-        "Function"       : Function,
-        "Scope"          : Scope,
-        "Differentiator" : Differentiator,
-        "Subsystem"      : Subsystem
-    }
-
-
-    #sort lines by prefixes
-
     block_lines = []
     connection_lines = []
-    state_lines = []
     parameter_lines = []
     equation_lines = []
     
@@ -87,6 +69,63 @@ def parse_simulation_file(filename):
             else:
                 raise ValueError(f"Unknown line prefix: {prefix}")
 
+    return block_lines, connection_lines, parameter_lines, equation_lines, dt, time
+
+
+def parse_simulation_file(filename, parameter_values={}, netlists=None, prefix=""):
+
+    """
+    load simulation blocks, connections and state 
+    from .txt file and returns blocks, connections 
+    and time if available
+
+    subsystems are flattened into the returned blocks with 
+    namespaced ids '<subsystem id>.<block id>' (also for their 
+    parameters), connections to a subsystem go to its first 
+    block and connections from it start at its last block, 
+    every subsystem file is only read once
+
+    a block line may end with 'sample_time=<value>' (number or 
+    parameter), for subsystems it applies to all their blocks 
+    without their own sample time
+
+    INPUTS:
+        filename         : path to file
+        parameter_values : (dict) values that override the PARAMETER 
+                           lines, vectors define batched variants, 
+                           '<subsystem id>.<name>' for subsystems
+        netlists         : (dict) cache of already read files, 
+                           filled by 'read_simulation_file'
+        prefix           : (str) namespace of the ids (for subsystems)
+    """
+
+    block_types = {
+        "Amplifier"      : Amplifier,
+        "Integrator"     : Integrator,
+        "Comparator"     : Comparator,
+        "Adder"          : Adder,
+        "Multiplier"     : Multiplier,
+        "Constant"       : Constant,
+        "Inverter"       : Inverter,
+        "Generator"      : Generator,
+        "Function"       : Function,
+        "LookupTable"    : LookupTable,
+        "Scope"          : Scope,
+        "Differentiator" : Differentiator,
+        "Subsystem"      : Subsystem
+    }
+
+
+    #read the file or get its lines from the cache
+    if netlists is None:
+        netlists = {}
+    if filename not in netlists:
+        netlists[filename] = read_simulation_file(filename)
+
+    block_lines, connection_lines, parameter_lines, equation_lines, dt, time = netlists[filename]
+
+    subsystem_ids = {block_id for block_id, block_type, *_ in block_lines if block_type == "Subsystem"}
+
     #handle parameters
     parameters = {}
     for line in parameter_lines:
@@ -97,6 +136,17 @@ def parse_simulation_file(filename):
             param, value = line
         parameters[param] = Parameter(param, value)
 
+    #override parameter values (or pass them to the subsystems)
+    subsystem_values = {block_id: {} for block_id in subsystem_ids}
+    for param, value in parameter_values.items():
+        block_id, _, name = param.partition(".")
+        if name and block_id in subsystem_ids:
+            subsystem_values[block_id][name] = value
+            continue
+        if param not in parameters:
+            raise ValueError(f"Unknown parameter: {prefix}{param}")
+        parameters[param] = Parameter(param, value)
+
     #handle equations
     equations = []
     for expr in equation_lines:
@@ -104,11 +154,43 @@ def parse_simulation_file(filename):
 
     #handle blocks
     blocks = {}
+    subsystem_parameters = []
+    connections = []
+
+    #first and last block of the subsystems
+    ports = {}
+
     for block_id, block_type, *block_args in block_lines:
 
-        #check if subsystem
+        #optional sample time of the block
+        sample_time = None
+        for arg in [arg for arg in block_args if arg.startswith("sample_time=")]:
+            block_args.remove(arg)
+            _, sample_time = arg.split("=", 1)
+            if sample_time in parameters:
+                sample_time = parameters[sample_time]
+
+        #flatten subsystem into the blocks
         if block_type == "Subsystem":
-            block = load_subsystem_from_file(*block_args)
+            sub_blocks, sub_connections, sub_parameters, sub_equations, *_ = parse_simulation_file(
+                *block_args, subsystem_values[block_id], netlists, f"{prefix}{block_id}.")
+
+            if len(sub_blocks) == 0:
+                raise ValueError(f"Subsystem {prefix}{block_id} has no blocks")
+
+            #equations of the subsystem only use its own parameters
+            for equation in sub_equations:
+                equation.compute(sub_parameters)
+            for parameter in sub_parameters:
+                parameter.parameter = f"{block_id}.{parameter.parameter}"
+
+            for block in sub_blocks:
+                if block.sample_time is None:
+                    block.sample_time = sample_time
+                blocks[block.id] = block
+            connections.extend(sub_connections)
+            subsystem_parameters.extend(sub_parameters)
+            ports[block_id] = (sub_blocks[0], sub_blocks[-1])
             continue
 
         #check if parameter given
@@ -117,26 +199,25 @@ def parse_simulation_file(filename):
                 block_args[i] = parameters[arg]
 
         #initialize block
-        block = block_types[block_type](*block_args)
-        block.id = block_id
+        block = block_types[block_type](*block_args, sample_time=sample_time)
+        block.id = f"{prefix}{block_id}" if prefix else block_id
 
         blocks[block_id] = block
 
     #handle connections
-    connections = []
     for source_block_id, target_block_id, target_input_name in connection_lines:
-        connections.append(Connection(blocks[target_block_id], 
-                                      target_input_name, 
-                                      blocks[source_block_id]))
+        source = ports[source_block_id][1] if source_block_id in ports else blocks[source_block_id]
+        target = ports[target_block_id][0] if target_block_id in ports else blocks[target_block_id]
+        connections.append(Connection(target, target_input_name, source))
 
     #rearrange into list
     blocks = list(blocks.values())
-    parameters = list(parameters.values())
+    parameters = list(parameters.values()) + subsystem_parameters
 
     return blocks, connections, parameters, equations, dt, time
         
 
-def load_subsystem_from_file(filename):
+def load_subsystem_from_file(filename, netlists=None):
 
     """
     load simulation blocks, connections and state 
@@ -144,26 +225,38 @@ def load_subsystem_from_file(filename):
 
     INPUTS:
         filename : path to file
+        netlists : (dict) cache of already read files
     """
     
-    blocks, connections, *_ = parse_simulation_file(filename)
+    blocks, connections, *_ = parse_simulation_file(filename, netlists=netlists)
 
     return Subsystem(blocks, connections, filename)
 
 
-def load_simulation_from_file(filename):
+def load_simulation_from_file(filename, engine="object", parameter_values={}, netlists=None, cache=None, **kwargs):
 
     """
     load simulation blocks, connections and state 
     from .txt file and returns simulation object
 
     INPUTS:
-        filename : path to file
+        filename         : path to file
+        engine           : (str) simulation engine, 'object' or 'array'
+        parameter_values : (dict) values that override the PARAMETER 
+                           lines, vectors define batched variants 
+                           (requires engine='array')
+        netlists         : (dict) cache of already read files
+        cache            : (NetlistCache) on-disk cache of the sorted blocks (see cache.py)
+        kwargs           : further arguments of the Simulation, 
+                           e.g. loop_solver
     """
 
-    blocks, connections, parameters, equations, dt, time = parse_simulation_file(filename)
+    if cache is not None:
+        return cache.load_simulation(filename, engine, parameter_values, netlists, **kwargs)
+
+    blocks, connections, parameters, equations, dt, time = parse_simulation_file(filename, parameter_values, netlists)
 
     if time is None or dt is None:
-        return Simulation(blocks, connections, parameters, equations)
+        return Simulation(blocks, connections, parameters, equations, engine=engine, **kwargs)
     else:
-        return Simulation(blocks, connections, parameters, equations, dt, time)
\ No newline at end of file
+        return Simulation(blocks, connections, parameters, equations, dt, time, engine=engine, **kwargs)
\ No newline at end of file
@@ -0,0 +1,214 @@
+#############################################################################
+##
+##                   PROFILING OF SIMULATIONS (profiler.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import json
+
+from time import perf_counter
+from collections import Counter
+
+import numpy as np
+
+
+# CLASSES ===================================================================
+
+class ProfileReport:
+
+    """
+    results of a profiled simulation, times are in seconds
+
+        steps          : number of timesteps
+        compute_time   : time spent in the timesteps
+        record_time    : time spent recording the probes
+        block_times    : cumulative compute time per block ('<label>_<id>')
+        block_calls    : number of compute calls per block
+        type_times     : cumulative compute time per block type
+        iterations     : histogram {iterations: steps} of the algebraic
+                         loop iterations per step (most iterations of all
+                         loops of the step)
+        non_converged  : times of the steps with non-converged loops
+    """
+
+    def __init__(self, steps, compute_time, record_time, block_times, block_calls, type_times, iterations, non_converged):
+
+        self.steps         = steps
+        self.compute_time  = compute_time
+        self.record_time   = record_time
+        self.block_times   = block_times
+        self.block_calls   = block_calls
+        self.type_times    = type_times
+        self.iterations    = iterations
+        self.non_converged = non_converged
+
+    def __str__(self):
+
+        lines = [f"steps         : {self.steps}",
+                 f"compute time  : {self.compute_time:.6f} s",
+                 f"record time   : {self.record_time:.6f} s",
+                 f"non-converged : {len(self.non_converged)} steps"]
+
+        if self.iterations:
+            lines.append("iterations    : " + ", ".join(f"{n}: {count}" for n, count in sorted(self.iterations.items())))
+
+        if self.type_times:
+            lines.append("block types   :")
+            for name, seconds in sorted(self.type_times.items(), key=lambda item: -item[1]):
+                lines.append(f"    {name:<16} {seconds:.6f} s")
+
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"steps"         : self.steps,
+                "compute_time"  : self.compute_time,
+                "record_time"   : self.record_time,
+                "block_times"   : self.block_times,
+                "block_calls"   : self.block_calls,
+                "type_times"    : self.type_times,
+                "iterations"    : {str(n): count for n, count in sorted(self.iterations.items())},
+                "non_converged" : self.non_converged}
+
+    def to_json(self, filename=None):
+        """
+        returns the report as json string and
+        writes it to 'filename' if given
+        """
+        text = json.dumps(self.to_dict(), indent=4)
+        if filename is not None:
+            with open(filename, "w") as file:
+                file.write(text)
+        return text
+
+
+class Profiler:
+
+    """
+    opt-in profiler of a simulation, set 'Simulation.profiler' to
+    a Profiler before 'run' or 'stream', the compute methods of the
+    blocks are wrapped with timers while attached, the code generation
+    engine uses the blocks while profiling and the array engine only
+    reports the times of the steps and of the recording
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        discard the collected data
+        """
+        self.steps         = 0
+        self.compute_time  = 0.0
+        self.record_time   = 0.0
+        self.block_times   = {}
+        self.block_calls   = {}
+        self.iterations    = Counter()
+        self.non_converged = []
+
+        #first block of every algebraic loop (compute calls count the iterations)
+        self.loops = []
+        self.calls_at_step = []
+
+        self.blocks = []
+
+    def attach(self, simulation):
+
+        """
+        wrap the compute methods of the blocks of the simulation
+
+        INPUTS:
+            simulation : (Simulation) simulation to profile
+        """
+
+        self.detach()
+        self.blocks = list(simulation.blocks)
+
+        for block in self.blocks:
+            self.block_times.setdefault(block, 0.0)
+            self.block_calls.setdefault(block, 0)
+            block.compute = self._timed(block, block.compute)
+
+        self.loops = [blocks[0] for blocks in simulation.algebraic_loops]
+        self.calls_at_step = [self.block_calls[block] for block in self.loops]
+
+    def detach(self):
+        """
+        restore the compute methods of the blocks
+        """
+        for block in self.blocks:
+            del block.compute
+        self.blocks = []
+
+    def _timed(self, block, compute):
+
+        block_times, block_calls = self.block_times, self.block_calls
+
+        def timed_compute(t, dt):
+            start = perf_counter()
+            compute(t, dt)
+            block_times[block] += perf_counter() - start
+            block_calls[block] += 1
+
+        return timed_compute
+
+    def step(self, simulation, seconds):
+
+        """
+        record one timestep of the simulation
+
+        INPUTS:
+            simulation : (Simulation) profiled simulation
+            seconds    : (float) duration of the timestep
+        """
+
+        self.steps += 1
+        self.compute_time += seconds
+
+        if self.loops:
+            calls = [self.block_calls[block] for block in self.loops]
+            self.iterations[max(c - p for c, p in zip(calls, self.calls_at_step))] += 1
+            self.calls_at_step = calls
+
+        if simulation.array_engine is None:
+            steady_state = simulation.steady_state
+        else:
+            steady_state = np.all(simulation.array_engine.steady_state)
+
+        if not steady_state:
+            self.non_converged.append(simulation.time)
+
+    def record(self, seconds):
+        """
+        add the time spent recording the probes
+        """
+        self.record_time += seconds
+
+    def report(self):
+        """
+        returns the collected data as ProfileReport
+        """
+        #unique names, blocks with the same label and id are numbered
+        names, used = {}, Counter()
+        for block in self.block_times:
+            name = f"{block.label}_{block.id}"
+            used[name] += 1
+            names[block] = name if used[name] == 1 else f"{name}#{used[name]}"
+
+        type_times = {}
+        for block, seconds in self.block_times.items():
+            name = type(block).__name__
+            type_times[name] = type_times.get(name, 0.0) + seconds
+
+        return ProfileReport(self.steps,
+                             self.compute_time,
+                             self.record_time,
+                             {names[block]: seconds for block, seconds in self.block_times.items()},
+                             {names[block]: calls for block, calls in self.block_calls.items()},
+                             type_times,
+                             dict(self.iterations),
+                             list(self.non_converged))
@@ -0,0 +1,410 @@
+#############################################################################
+##
+##                  REAL-TIME CO-SIMULATION (realtime.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import asyncio
+
+from array import array
+from time import perf_counter
+
+import numpy as np
+
+from blocks import Constant
+
+
+# CLASSES ===================================================================
+
+class Source:
+
+    """
+    base class for asynchronous inputs of a 'RealtimeRunner',
+    'read' returns the values that arrived since the last read
+    as {block id: value}, the input blocks hold their values
+    until new ones arrive
+    """
+
+    async def open(self):
+        pass
+
+    async def read(self):
+        raise NotImplementedError()
+
+    async def close(self):
+        pass
+
+
+class AsyncSink:
+
+    """
+    base class for asynchronous consumers of the samples of a
+    'RealtimeRunner', opened with the column labels, 'write'
+    receives the time and the probe values of every sample
+    """
+
+    async def open(self, labels):
+        pass
+
+    async def write(self, time, values):
+        raise NotImplementedError()
+
+    async def close(self):
+        pass
+
+
+class QueueSource(Source):
+
+    """
+    inputs from an asyncio.Queue of (block id, value) pairs,
+    all queued pairs are consumed at every read
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    async def read(self):
+        values = {}
+        while not self.queue.empty():
+            block_id, value = self.queue.get_nowait()
+            values[block_id] = value
+        return values
+
+
+class QueueSink(AsyncSink):
+
+    """
+    puts the samples as (time, values) into an asyncio.Queue,
+    samples are dropped while the queue is full
+    """
+
+    def __init__(self, queue):
+        self.queue   = queue
+        self.dropped = 0
+
+    async def write(self, time, values):
+        try:
+            self.queue.put_nowait((time, values))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+
+class SocketAdapter(Source, AsyncSink):
+
+    """
+    local TCP (host, port) or UNIX (path) socket server that is
+    source and sink at once, clients send input values as lines
+    '<block id> <value>' and receive the labels and then every
+    sample as lines of space separated values, lines that cannot
+    be parsed are counted as 'invalid', samples for clients that
+    do not read fast enough are counted as 'dropped'
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, path=None, buffer_size=2**20):
+
+        """
+        INPUTS:
+            host        : (str) address of the TCP server
+            port        : (int) port of the TCP server, 0 selects a free port
+            path        : (str) path of the UNIX socket (instead of TCP)
+            buffer_size : (int) largest unsent data per client [bytes]
+        """
+
+        self.host        = host
+        self.port        = port
+        self.path        = path
+        self.buffer_size = buffer_size
+
+        self.server  = None
+        self.writers = []
+        self.labels  = None
+        self.values  = {}
+
+        self.invalid = 0
+        self.dropped = 0
+
+    async def open(self, labels=None):
+
+        if labels is not None:
+            self.labels = labels
+
+        #the adapter is opened as source and as sink
+        if self.server is not None:
+            return
+
+        if self.path is None:
+            self.server = await asyncio.start_server(self._client, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+        else:
+            self.server = await asyncio.start_unix_server(self._client, self.path)
+
+    async def _client(self, reader, writer):
+
+        if self.labels is not None:
+            writer.write((" ".join(self.labels) + "\n").encode())
+        self.writers.append(writer)
+
+        try:
+            async for line in reader:
+                try:
+                    block_id, value = line.decode().split()
+                    self.values[block_id] = float(value)
+                except ValueError:
+                    self.invalid += 1
+        except ConnectionError:
+            pass
+        finally:
+            if writer in self.writers:
+                self.writers.remove(writer)
+            writer.close()
+
+    async def read(self):
+        values, self.values = self.values, {}
+        return values
+
+    async def write(self, time, values):
+        line = (" ".join(repr(float(v)) for v in [time, *values]) + "\n").encode()
+        for writer in self.writers:
+            if writer.transport.get_write_buffer_size() > self.buffer_size:
+                self.dropped += 1
+            else:
+                writer.write(line)
+
+    async def close(self):
+
+        if self.server is None:
+            return
+
+        self.server.close()
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+        await self.server.wait_closed()
+        self.server = None
+
+
+class RealtimeReport:
+
+    """
+    timing of a real-time run, times are in seconds
+
+        steps           : number of timesteps
+        wall_time       : duration of the run
+        deadline_misses : steps that finished after their wall-clock deadline
+        max_lateness    : largest delay of a step after its deadline
+        latencies       : duration of every step (inputs, update and outputs)
+        rejected_inputs : values for blocks that are no inputs
+    """
+
+    def __init__(self, steps, wall_time, deadline_misses, max_lateness, latencies, rejected_inputs):
+
+        self.steps           = steps
+        self.wall_time       = wall_time
+        self.deadline_misses = deadline_misses
+        self.max_lateness    = max_lateness
+        self.latencies       = latencies
+        self.rejected_inputs = rejected_inputs
+
+    def latency(self, percentile=50):
+        """
+        percentile of the step latencies
+        """
+        return float(np.percentile(self.latencies, percentile)) if len(self.latencies) else 0.0
+
+    def __str__(self):
+
+        lines = [f"steps           : {self.steps}",
+                 f"wall time       : {self.wall_time:.6f} s",
+                 f"deadline misses : {self.deadline_misses}",
+                 f"max lateness    : {self.max_lateness:.6f} s"]
+
+        if len(self.latencies):
+            lines.append(f"latency         : {self.latency(50)*1e6:.1f} us median, "
+                         f"{self.latency(99)*1e6:.1f} us p99, {np.max(self.latencies)*1e6:.1f} us max")
+
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"steps"           : self.steps,
+                "wall_time"       : self.wall_time,
+                "deadline_misses" : self.deadline_misses,
+                "max_lateness"    : self.max_lateness,
+                "latency_median"  : self.latency(50),
+                "latency_p99"     : self.latency(99),
+                "latency_max"     : float(np.max(self.latencies)) if len(self.latencies) else 0.0,
+                "rejected_inputs" : self.rejected_inputs}
+
+
+class RealtimeRunner:
+
+    """
+    advances a simulation within an asyncio event loop, paced to
+    the wall-clock (step k finishes before 'start + simulation time'
+    has passed) or as fast as possible, the values from the sources
+    set the outputs of the input blocks (Constant blocks) before every
+    step and the probes (default the Scope blocks) are written to the
+    sinks, the event loop runs between the steps
+
+    the pacing is anchored to the start, so late steps are caught up
+    and counted as deadline misses, the latencies of the steps help
+    to size dt for real-time operation
+    """
+
+    def __init__(self, simulation, inputs=[], sources=[], sinks=[], realtime=True, probes=None, decimation=1):
+
+        """
+        INPUTS:
+            simulation : (Simulation) simulation to advance
+            inputs     : (list) ids of the Constant blocks that receive the source values
+            sources    : (list) Source objects
+            sinks      : (list) AsyncSink objects
+            realtime   : (bool) pace the steps to the wall-clock, otherwise as fast as possible
+            probes     : (list) ids of the blocks to publish, defaults to the Scope blocks
+            decimation : (int) publish only every n-th timestep
+        """
+
+        self.simulation = simulation
+        self.sources    = sources
+        self.sinks      = sinks
+        self.realtime   = realtime
+        self.decimation = decimation
+
+        self.inputs = {}
+        for block_id in inputs:
+            block = simulation.get_block(block_id)
+            if not isinstance(block, Constant):
+                raise ValueError(f"Input block {block.label}_{block.id} has to be a Constant block")
+            self.inputs[str(block.id)] = block
+
+        self.probes = simulation._get_probes(probes)
+
+        self.running = False
+        self.reset()
+
+    def reset(self):
+        """
+        discard the collected timing
+        """
+        self.steps           = 0
+        self.wall_time       = 0.0
+        self.deadline_misses = 0
+        self.max_lateness    = 0.0
+        self.latencies       = array("d")
+        self.rejected_inputs = 0
+
+    def stop(self):
+        """
+        end 'run' after the current step
+        """
+        self.running = False
+
+    def _set_input(self, block, value):
+        sim = self.simulation
+        if not np.array_equal(block.output, value):
+            #inputs of the linear networks and the comparators at the 
+            #start of the step are computed again with the new value
+            sim.linear_time = None
+            sim.event_values = None
+        block.output = value
+        engine = sim.array_engine
+        if engine is not None:
+            engine.outputs[engine.index[block]] = value
+
+    async def run(self, duration=None, max_iterations=100, tolerance=1e-6):
+
+        """
+        advance the simulation until 'duration' (simulation time)
+        is reached or 'stop' is called and return the RealtimeReport
+
+        INPUTS:
+            duration       : (float) simulation time [s], None runs until 'stop'
+            max_iterations : (int) maximum numbver of fixed-point iterations
+            tolerance      : (float) tolerance for convergence of fixed-point iterations
+        """
+
+        sim = self.simulation
+
+        start_time = sim.time
+        end_time = None if duration is None else start_time + duration
+
+        #published blocks (as for 'Simulation.run')
+        sim.probes = self.probes
+        read_probes = sim._probe_reader()
+        labels = ["time"] + sim._probe_labels()
+
+        for source in self.sources:
+            await source.open()
+        for sink in self.sinks:
+            await sink.open(labels)
+
+        self.running = True
+        wall_start = perf_counter()
+
+        try:
+
+            while self.running and (end_time is None or end_time - sim.time > 1e-12 * max(1.0, abs(end_time))):
+
+                step_start = perf_counter()
+
+                #newest values of the inputs
+                for source in self.sources:
+                    for block_id, value in (await source.read()).items():
+                        block = self.inputs.get(str(block_id))
+                        if block is None:
+                            self.rejected_inputs += 1
+                        else:
+                            self._set_input(block, value)
+
+                sim.update(max_iterations, tolerance, False, end_time)
+                self.steps += 1
+
+                if self.steps % self.decimation == 0:
+                    values = np.asarray(read_probes(), dtype=float).ravel()
+                    for sink in self.sinks:
+                        await sink.write(sim.time, values)
+
+                now = perf_counter()
+                self.latencies.append(now - step_start)
+
+                if not self.realtime:
+                    await asyncio.sleep(0)
+                    continue
+
+                #wall-clock time of the end of the step
+                deadline = wall_start + (sim.time - start_time)
+                if now > deadline:
+                    self.deadline_misses += 1
+                    self.max_lateness = max(self.max_lateness, now - deadline)
+                    await asyncio.sleep(0)
+                else:
+                    await asyncio.sleep(deadline - now)
+
+        finally:
+
+            self.running = False
+            self.wall_time += perf_counter() - wall_start
+
+            for source in self.sources:
+                await source.close()
+            for sink in self.sinks:
+                await sink.close()
+
+            if sim.array_engine is not None:
+                sim.array_engine.sync()
+
+        return self.report()
+
+    def report(self):
+        """
+        returns the collected timing as RealtimeReport
+        """
+        return RealtimeReport(self.steps,
+                              self.wall_time,
+                              self.deadline_misses,
+                              self.max_lateness,
+                              np.array(self.latencies),
+                              self.rejected_inputs)
@@ -8,8 +8,29 @@
 
 # IMPORTS ===================================================================
 
+import numpy as np
+
+from copy import deepcopy
+from math import ceil
+from time import perf_counter
+
+from blocks import Scope, Integrator, Comparator
+from checkpoint import Checkpoint, write_checkpoint, read_checkpoint
+from codegen import generate_source, compile_source
+from linear import LinearNetwork, find_linear_networks
+from engine import ArrayEngine
+from loops import deviation, solve_fixed_point, solve_newton
+from solvers import SOLVERS, error_norm, step_factor
 from utils import timer
 
+
+# GLOBALS ===================================================================
+
+#attributes of the connected, checked and sorted blocks (see 'Simulation.get_graph')
+GRAPH_ATTRIBUTES = ("blocks", "schedule", "algebraic_loops", "integrators", 
+                    "discrete_blocks", "update_order", "block_index", "positions")
+
+
 # CLASSES ===================================================================
 
 class Connection:
@@ -26,6 +47,50 @@ class Connection:
         self.source       = source
 
 
+class Transaction:
+
+    """
+    collects blocks and connections for a simulation and 
+    adds them together on commit, so a large diagram is 
+    validated and sorted only once (see 'Simulation.transaction'), 
+    used as context manager it commits at the end of the block
+    """
+
+    def __init__(self, simulation):
+
+        self.simulation  = simulation
+        self.blocks      = []
+        self.connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def add_block(self, block):
+        self.blocks.append(block)
+        return block
+
+    def add_connection(self, connection):
+        self.connections.append(connection)
+        return connection
+
+    def connect(self, source, target, target_input="input"):
+        """
+        connect the output of 'source' to an input of 'target'
+        """
+        return self.add_connection(Connection(target, target_input, source))
+
+    def commit(self):
+        """
+        add the collected blocks and connections to the simulation
+        """
+        self.simulation.add_blocks(self.blocks, self.connections)
+        self.blocks, self.connections = [], []
+
+
 class Simulation:
 
     """
@@ -33,7 +98,9 @@ class Simulation:
     and connections and the timestep update
     """
 
-    def __init__(self, blocks=[], connections=[], parameters=[], equations=[], dt=0.01, time=0):
+    def __init__(self, blocks=[], connections=[], parameters=[], equations=[], dt=0.01, time=0, engine="object", loop_solver="fixed-point", 
+                 solver=None, adaptive=False, rtol=1e-6, atol=1e-9, min_dt=1e-12, max_dt=None, exact_linear=False, 
+                 predictor=None, events=False, event_tolerance=1e-9, graph=None):
 
         """
         initialize the simulation
@@ -43,111 +110,682 @@ class Simulation:
             connections : (list) list of Connection objects
             dt          : (float) timestep
             time        : (float) sinulation time
+            engine      : (str) 'object' to compute the blocks one by one, 
+                          'array' to compile them into numpy arrays,
+                          'codegen' to generate a python function for the
+                          whole diagram (fixed-point loops only)
+            loop_solver : (str) solver for algebraic loops, 'fixed-point', 
+                          'newton' or 'broyden' (object engine only)
+            solver      : (str) solver that advances all integrator states 
+                          together ('euler', 'rk4', 'rk23', 'rk45' or the implicit 
+                          'backward-euler', 'bdf2' for stiff systems), None uses 
+                          the trapezoidal rule of the Integrator blocks 
+                          (or 'rk23' in adaptive mode)
+            adaptive    : (bool) advance the integrators with the embedded 
+                          runge-kutta pair of the solver and adapt dt to 
+                          the local error
+            rtol        : (float) relative tolerance of the adaptive mode
+            atol        : (float) absolute tolerance of the adaptive mode
+            min_dt      : (float) smallest timestep of the adaptive mode
+            max_dt      : (float) largest timestep of the adaptive mode
+            exact_linear : (bool) advance the integrators of the linear sub-networks 
+                           exactly (matrix exponential) with the inputs from the 
+                           other blocks held constant over the timestep
+            predictor   : (str) initial guess of the algebraic loops by 'linear' or 
+                          'quadratic' extrapolation of the previous timesteps, 
+                          None starts from the previous outputs (object engine only)
+            events      : (bool) end the steps of the global solver (default 'rk4') 
+                          exactly where a Comparator switches
+            event_tolerance : (float) accuracy of the switching times [s]
+            graph       : (dict) connected and sorted blocks from 'get_graph' 
+                          (e.g. from the cache, see cache.py) that replace 
+                          the connection, checks and sorting of the blocks
+
+        blocks with a 'sample_time' are only computed on their own ticks 
+        (multiples of the sample time) and hold their outputs in between 
+        (object engine with the Integrator blocks only)
         """
 
-        self.blocks      = blocks
-        self.connections = connections
+        if engine not in ("object", "array", "codegen"):
+            raise ValueError(f"Unknown engine: {engine}")
+
+        if loop_solver not in ("fixed-point", "newton", "broyden"):
+            raise ValueError(f"Unknown loop solver: {loop_solver}")
+
+        if engine == "codegen" and loop_solver != "fixed-point":
+            raise ValueError("The code generation only supports the 'fixed-point' loop solver")
+
+        if solver is not None and solver not in SOLVERS:
+            raise ValueError(f"Unknown solver: {solver}")
+
+        if adaptive and solver is None:
+            solver = "rk23"
+
+        if events and solver is None:
+            solver = "rk4"
+
+        if adaptive and not SOLVERS[solver].adaptive:
+            raise ValueError(f"Solver '{solver}' has no error estimate for the adaptive mode")
+
+        if solver is not None and engine != "object":
+            raise ValueError("Global solvers and the adaptive mode require engine='object'")
+
+        if predictor not in (None, "linear", "quadratic"):
+            raise ValueError(f"Unknown predictor: {predictor}")
+
+        if predictor is not None and engine != "object":
+            raise ValueError("The predictor requires engine='object'")
+
+        if exact_linear and (solver is not None or engine != "object"):
+            raise ValueError("The exact linear mode requires engine='object' and no global solver")
+
+        self.blocks      = list(blocks)
+        self.connections = list(connections)
         self.parameters  = parameters
         self.equations   = equations
         self.dt          = dt
         self.time        = time
+        self.engine      = engine
+        self.loop_solver = loop_solver
+
+        #solver for the integrator states (None for the Integrator blocks)
+        self.solver = None if solver is None else deepcopy(SOLVERS[solver])
+
+        #adaptive timestep control
+        self.adaptive = adaptive
+        self.rtol     = rtol
+        self.atol     = atol
+        self.min_dt   = min_dt
+        self.max_dt   = max_dt
+
+        #linear sub-networks with the indices of their states (exact linear mode)
+        self.exact_linear = exact_linear
+        self.linear_networks = []
+        self.linear_indices = []
+        self.linear_schedule = ([], [], False)
+        self.linear_time = None
+
+        #convergence of the algebraic loops within the current step
+        self.steady_state = True
+
+        #event detection, comparator inputs relative to their thresholds 
+        #at the end of the last step as (time, values) and the located 
+        #events as (time, switched comparators)
+        self.detect_events = events
+        self.event_tolerance = event_tolerance
+        self.comparators = []
+        self.event_values = None
+        self.events = []
+
+        #blocks whose outputs are held during the stages of a solver step
+        self.held_blocks = frozenset()
+
+        #end of the fixed step that was shortened by the last event, 
+        #the next step returns to it (None if on the regular steps)
+        self.event_step_end = None
+
+        #sample times of the blocks with their last tick as (count, time) 
+        #and the schedules for the combinations of ticking sample times
+        self.rate_ticks = {}
+        self.rate_schedules = {}
+
+        #extrapolation of the loop outputs and their values of the last steps
+        self.predictor = predictor
+        self.loop_history = []
+
+        #opt-in Profiler that is attached by 'run' and 'stream' (see profiler.py)
+        self.profiler = None
+
+        #compiled array engine (only used for engine='array')
+        self.array_engine = None
+
+        #generated step functions by recorded blocks and the 
+        #source of the last generated one (only used for engine='codegen')
+        self.step_functions = {}
+        self.step_source = None
+
+        #blocks that are recorded by 'run'
+        self.probes = []
+
+        #evaluation order and algebraic loops (set by '_sort_blocks')
+        self.schedule = []
+        self.algebraic_loops = []
+
+        #blocks with internal states and their order for 'update_output' (set by '_sort_blocks')
+        self.integrators = []
+        self.discrete_blocks = []
+        self.update_order = []
+
+        #blocks by id and their positions in the evaluation order (set by '_sort_blocks')
+        self.block_index = {}
+        self.positions = {}
+
+        #full states of the blocks, timestep and solver at the start of the simulation
+        self.initial_state = {}
+        self.initial_dt = dt
+        self.initial_solver = deepcopy(self.solver)
+
+        #number of parameter variants (None if not batched)
+        self.batch_size = None
 
         if len(blocks) > 0: 
-            self._initialize_simulation()
+            self._initialize_simulation(graph)
 
 
-    def _initialize_simulation(self):
+    def _initialize_simulation(self, graph=None):
 
         """
         Initialize the connections between the blocks and do 
         some preprocessing to improve the convergence of the simulation.
+
+        INPUTS:
+            graph : (dict) connected and sorted blocks from 'get_graph'
         """
 
         #update parameters from equations
         for equation in self.equations:
             equation.compute(self.parameters)
 
-        #initialize the input connections for each block
-        for connection in self.connections:
-            connection.target.connect(connection.target_input, connection.source)
+        #vector parameters define a batch of variants
+        batch_sizes = {p.batch_size for p in self.parameters if p.batch_size is not None}
+        if len(batch_sizes) > 1:
+            raise ValueError(f"Vector parameters have different lengths: {sorted(batch_sizes)}")
+        self.batch_size = batch_sizes.pop() if batch_sizes else None
 
-        #check blocks for parameters and update their values
-        for block in self.blocks:
-            block.check_parameter()
+        if self.batch_size is not None and self.engine != "array":
+            raise ValueError("Vector parameters (batched simulation) require engine='array'")
 
-        #sort the blocks based on their dependencies
-        self.blocks = self._sort_blocks()
+        if graph is None:
+
+            #initialize the input connections for each block
+            for connection in self.connections:
+                connection.target.connect(connection.target_input, connection.source)
+
+            #check blocks for parameters and update their values
+            for block in self.blocks:
+                block.check_parameter()
+                block.check_sample_time()
+
+            #sort the blocks based on their dependencies
+            self._resort()
+
+        else:
+            for name in GRAPH_ATTRIBUTES:
+                setattr(self, name, graph[name])
+            self.loop_history = [[] for _ in self.algebraic_loops]
 
         #save the initial state
-        self.initial_state = self.get_state()
+        self.initial_state = {block: block.get_full_state() for block in self.blocks}
+
+        #compile the blocks into arrays
+        self._compile_engine()
+
+
+    def get_graph(self):
+        """
+        returns the connected, checked and sorted blocks as dict 
+        for 'Simulation(graph=...)', the blocks are shared, so 
+        it describes the initial graph only before the first step
+        """
+        return {name: getattr(self, name) for name in GRAPH_ATTRIBUTES}
+
+
+    def _compile_engine(self, new_blocks=None, resorted=True):
+        """
+        (re)build the array engine or the generated 
+        step function from the sorted blocks
+
+        INPUTS:
+            new_blocks : (list) blocks added since the last build (None for all blocks)
+            resorted   : (bool) the blocks were sorted again since the last build
+        """
+        if self.engine == "array":
+            self.array_engine = ArrayEngine(self.blocks, self.batch_size, self.update_order)
+        if self.detect_events:
+            self.comparators = [block for block in self.blocks if isinstance(block, Comparator)]
+            self.event_values = None
+        if self.engine == "codegen":
+            self.step_functions = {}
+            self._step_function([])
+        self._initialize_rates(new_blocks, resorted)
+        if self.exact_linear:
+            self.linear_networks = [LinearNetwork(blocks) for blocks in find_linear_networks(self.blocks)]
+            self.linear_indices = [[self.integrators.index(block) for block in network.integrators] 
+                                   for network in self.linear_networks]
+            self.linear_schedule = self._linear_schedule()
+            self.linear_time = None
+
+
+    def _initialize_rates(self, new_blocks=None, resorted=True):
+        """
+        check the sample times of the (new) blocks and start the 
+        ticks of new sample times at the current time, the 
+        algebraic loops only change when the blocks are sorted
+
+        INPUTS:
+            new_blocks : (list) blocks added since the last check (None for all blocks)
+            resorted   : (bool) the blocks were sorted again since the last check
+        """
+        #the schedules depend on the evaluation order
+        self.rate_schedules = {}
+
+        sample_times = {block.sample_time for block in (self.blocks if new_blocks is None else new_blocks)} - {None}
+
+        if sample_times and (self.engine != "object" or self.solver is not None 
+                             or self.exact_linear or self.predictor is not None):
+            raise ValueError("Sample times require engine='object' without global solver, "
+                             "exact linear mode and predictor")
+
+        if resorted and (sample_times or self.rate_ticks):
+            for blocks in self.algebraic_loops:
+                if len({block.sample_time for block in blocks}) > 1:
+                    raise ValueError("Blocks of an algebraic loop need the same sample time: " 
+                                     + ", ".join(f"{block.label}_{block.id}" for block in blocks))
+
+        #new blocks keep the ticks unless they bring new sample times
+        if new_blocks is not None:
+            if sample_times <= self.rate_ticks.keys():
+                return
+            sample_times |= self.rate_ticks.keys()
+
+        self.rate_ticks = {sample_time: self.rate_ticks.get(sample_time, (self._tick_count(self.time, sample_time), self.time)) 
+                           for sample_time in sorted(sample_times)}
+
+
+    def _tick_count(self, time, sample_time):
+        """
+        number of ticks of a sample time until 'time' 
+        (robust against the rounding of the time)
+        """
+        return int(np.floor(time / sample_time + 1e-9))
+
+
+    def _rate_schedule(self, active):
+        """
+        returns the schedule of the blocks whose sample times 
+        tick as (blocks, is_loop, sample_time) groups and the 
+        blocks to update afterwards
+
+        INPUTS:
+            active : (set) ticking sample times (None for every timestep)
+        """
+        schedule = []
+
+        for blocks, is_loop in self.schedule:
+
+            if is_loop:
+                if blocks[0].sample_time in active:
+                    schedule.append((blocks, True, blocks[0].sample_time))
+                continue
+
+            for block in blocks:
+                if block.sample_time not in active:
+                    continue
+                if schedule and not schedule[-1][1] and schedule[-1][2] == block.sample_time:
+                    schedule[-1][0].append(block)
+                else:
+                    schedule.append(([block], False, block.sample_time))
+
+        return schedule, [block for block in self.update_order if block.sample_time in active]
+
+
+    def _step_function(self, probes):
+        """
+        returns the generated step function that records 
+        the probes, generated once per set of probes
+        """
+        key = tuple(self.positions[block] for block in probes)
+        if key not in self.step_functions:
+            self.step_source = generate_source(self.blocks, self.schedule, probes, self.update_order)
+            self.step_functions[key] = compile_source(self.step_source)
+        return self.step_functions[key]
+
+
+    def transaction(self):
+        """
+        returns a Transaction that adds many blocks and 
+        connections to the simulation at once
+        """
+        return Transaction(self)
+
+
+    def add_blocks(self, blocks, connections=[]):
+
+        """
+        add multiple blocks and connections to the simulation, 
+        they are validated (unique ids, connected blocks belong 
+        to the simulation) before anything is changed and the 
+        blocks are sorted only once
+
+        INPUTS:
+            blocks      : (list) new Block objects
+            connections : (list) new Connection objects
+        """
+
+        ids = set(self.block_index)
+        for block in blocks:
+            if block.id is not None and block.id in ids:
+                raise ValueError(f"Duplicate block id {block.id!r}")
+            ids.add(block.id)
+
+        known = set(self.blocks).union(blocks)
+        for connection in connections:
+            for block in (connection.source, connection.target):
+                if block not in known:
+                    raise ValueError(f"Connection to block {block.label}_{block.id} that is not part of the simulation")
+
+        #first blocks of an empty simulation initialize it
+        if len(self.blocks) == 0:
+            self.blocks = list(blocks)
+            self.connections = self.connections + list(connections)
+            self._initialize_simulation()
+            return
+
+        for connection in connections:
+            connection.target.connect(connection.target_input, connection.source)
+
+        for block in blocks:
+            block.check_parameter()
+            block.check_sample_time()
+            self.initial_state[block] = block.get_full_state()
+
+        self.blocks = self.blocks + list(blocks)
+        self.connections = self.connections + list(connections)
+        self._resort()
+        self._compile_engine(blocks)
 
 
     def add_block(self, block):
         """
-        add block to existing simulation
+        add block to existing simulation, a block without 
+        inputs is appended to the evaluation order without 
+        sorting (its connections follow with 'add_connection')
         """
+        if len(self.blocks) == 0 or len(block.inputs) > 0:
+            self.add_blocks([block])
+            return
+
+        if block.id is not None and block.id in self.block_index:
+            raise ValueError(f"Duplicate block id {block.id!r}")
+
+        block.check_parameter()
+        block.check_sample_time()
+
         self.blocks.append(block)
-        self.blocks = self._sort_blocks()
-        self.initial_state = self.get_state()
+        self.positions[block] = len(self.blocks) - 1
+        self.block_index[block.id] = block
+        self.initial_state[block] = block.get_full_state()
+
+        if isinstance(block, Integrator):
+            self.integrators.append(block)
+        elif not block.feedthrough:
+            self.discrete_blocks.append(block)
+
+        #the new last block is the first root of '_update_order' and has no inputs
+        if not block.feedthrough:
+            self.update_order.insert(0, block)
+
+        if self.schedule and not self.schedule[-1][1]:
+            self.schedule[-1][0].append(block)
+        else:
+            self.schedule.append(([block], False))
+
+        self._compile_engine([block], resorted=False)
         
 
     def add_connection(self, connection):
         """
-        add connection to existing simulation
+        add connection to existing simulation, the blocks 
+        are only sorted again if the connection contradicts 
+        the current evaluation order
         """
-        connection.target.connect(connection.target_input, connection.source)
+        source, target = connection.source, connection.target
+        target.connect(connection.target_input, source)
         self.connections.append(connection)
-        self.blocks = self._sort_blocks()
+
+        #connections from blocks without feedthrough or to later blocks keep the order valid
+        resorted = source.feedthrough and not (source in self.positions and target in self.positions 
+                                               and self.positions[source] < self.positions[target])
+        if resorted:
+            self._resort()
+
+        #connections of blocks with internal states can change their update order
+        elif not source.feedthrough or not target.feedthrough:
+            self.update_order = self._update_order()
+
+        self._compile_engine([], resorted)
         
 
     def _sort_blocks(self):
 
         """
-        sort the blocks chronologically by their connections 
-        using a recursive depth-first search function 
-        that visits each block and its dependencies
+        sort the blocks chronologically by their dependencies within 
+        one timestep and find the algebraic loops as the strongly 
+        connected components of the dependency graph (tarjan's algorithm 
+        with an explicit stack, so the depth of the diagram is not limited 
+        by the recursion limit), blocks without direct feedthrough 
+        (Integrator, Differentiator, Subsystem) only change their outputs 
+        in 'update_output' and therefore break the loops
+
+        the resulting schedule for 'update' is saved as 'self.schedule', 
+        a list of (blocks, is_loop) groups in evaluation order, and 
+        the algebraic loops (cycles) as 'self.algebraic_loops', the 
+        integrators (global states) and other blocks without feedthrough 
+        as 'self.integrators' and 'self.discrete_blocks'
+        """
+
+        index, lowlink = {}, {}
+        stack, on_stack = [], set()
+        components = []
+
+        def dependencies(block):
+            #outputs of blocks without feedthrough are fixed within the timestep
+            return iter([connected_block for connected_block in block.inputs.values() 
+                         if connected_block.feedthrough])
+
+        def enter(block):
+            index[block] = lowlink[block] = len(index)
+            stack.append(block)
+            on_stack.add(block)
+            return block, dependencies(block)
+
+        for root in self.blocks:
+
+            if root in index:
+                continue
+
+            #depth-first search with an explicit stack of (block, remaining dependencies)
+            path = [enter(root)]
+
+            while path:
+
+                block, remaining = path[-1]
+
+                for connected_block in remaining:
+
+                    if connected_block not in index:
+                        path.append(enter(connected_block))
+                        break
+
+                    elif connected_block in on_stack:
+                        lowlink[block] = min(lowlink[block], index[connected_block])
+
+                else:
+
+                    #all dependencies of the block are visited
+                    path.pop()
+                    if path:
+                        parent, _ = path[-1]
+                        lowlink[parent] = min(lowlink[parent], lowlink[block])
+
+                    #block is the root of a strongly connected component
+                    if lowlink[block] == index[block]:
+                        component = []
+                        while True:
+                            connected_block = stack.pop()
+                            on_stack.discard(connected_block)
+                            component.append(connected_block)
+                            if connected_block is block:
+                                break
+                        components.append(component[::-1])
+
+        #components are in topological order, merge consecutive feed-forward blocks
+        self.schedule = []
+        self.algebraic_loops = []
+
+        self.loop_history = []
+
+        for component in components:
+
+            block, *_ = component
+            is_loop = len(component) > 1 or (block.feedthrough and block in block.inputs.values())
+
+            if is_loop:
+                self.algebraic_loops.append(component)
+                self.schedule.append((component, True))
+                self.loop_history.append([])
+            elif self.schedule and not self.schedule[-1][1]:
+                self.schedule[-1][0].append(block)
+            else:
+                self.schedule.append(([block], False))
+
+        sorted_blocks = [block for component in components for block in component]
+
+        self.integrators = [block for block in sorted_blocks if isinstance(block, Integrator)]
+        self.discrete_blocks = [block for block in sorted_blocks 
+                                if not block.feedthrough and not isinstance(block, Integrator)]
+
+        #index by id (first block for duplicate ids) and positions in the order
+        self.block_index = {}
+        for block in reversed(sorted_blocks):
+            self.block_index[block.id] = block
+        self.positions = {block: i for i, block in enumerate(sorted_blocks)}
+
+        return sorted_blocks
+
+
+    def _resort(self):
+        """
+        sort the blocks again and recompute their order for 
+        'update_output' (from the order before sorting), the 
+        changes of the graph that cannot keep the evaluation 
+        order go through here
+        """
+        self.update_order = self._update_order()
+        self.blocks = self._sort_blocks()
+
+
+    def _update_order(self):
+
+        """
+        returns the blocks without feedthrough in the order of a 
+        depth-first search over all connections (also through the 
+        states) with the roots from the end of the blocks, the 
+        'prev_input' of a block depends on whether its input block 
+        was updated before it, so this order keeps the results of 
+        existing models (explicit stack, like '_sort_blocks')
         """
 
         visited = set()
-        sorted_blocks = []
+        order = []
+
+        def enter(block):
+            visited.add(block)
+            return block, iter(block.inputs.values())
 
-        def visit(block):
+        for root in reversed(self.blocks):
 
-            if block not in visited:
+            if root in visited:
+                continue
 
-                visited.add(block)
+            path = [enter(root)]
 
-                for connected_block in block.inputs.values():
+            while path:
 
+                block, remaining = path[-1]
+
+                for connected_block in remaining:
                     if connected_block not in visited:
-                        visit(connected_block)
+                        path.append(enter(connected_block))
+                        break
 
-                sorted_blocks.append(block)
+                else:
+                    path.pop()
+                    if not block.feedthrough:
+                        order.append(block)
 
-        unsorted_blocks = list(self.blocks)
+        return order
 
-        while unsorted_blocks:
 
-            current_block = unsorted_blocks.pop()
+    def get_levels(self):
 
-            if current_block not in visited:
-                visit(current_block)
+        """
+        returns the blocks grouped into levels, the blocks of a level 
+        only depend on blocks of earlier levels within the timestep and 
+        are independent of each other (every algebraic loop is part of 
+        a single level), so they can be evaluated in any order or together
+        """
 
-        return sorted_blocks
+        level = {}
+        levels = []
+
+        for blocks, is_loop in self.schedule:
 
+            #an algebraic loop is one unit, feed-forward blocks are separate
+            for component in ([blocks] if is_loop else [[block] for block in blocks]):
 
-    def update(self, max_iterations=20, tolerance=1e-6, debug=False):
+                members = set(component)
+                component_level = max((level[connected_block] + 1 for block in component 
+                                       for connected_block in block.inputs.values() 
+                                       if connected_block.feedthrough and connected_block in level 
+                                       and connected_block not in members), default=0)
+
+                for block in component:
+                    level[block] = component_level
+
+                if component_level == len(levels):
+                    levels.append([])
+                levels[component_level].extend(component)
+
+        return levels
+
+
+    def update(self, max_iterations=20, tolerance=1e-6, debug=False, t_stop=None):
 
         """
-        perform one update of the simulation (time increment by dt)
-        resolve steady state by fixed-point iteration
+        perform one update of the simulation (time increment by dt),
+        feed-forward blocks are computed once and the algebraic loops 
+        are resolved by fixed-point iteration
 
         INPUTS:
             max_iterations : (int) maximum numbver of fixed-point iterations
             tolerance      : (float) tolerance for convergence of fixed-point iterations
             debug          : (bool) print debugging info (convergence etc.)
+            t_stop         : (float) time that is not stepped over (adaptive mode)
         """
 
+        #advance the integrator states with error control
+        if self.adaptive:
+            self._update_adaptive(max_iterations, tolerance, debug, t_stop)
+            return
+
+        #advance the integrator states with the global solver
+        if self.solver is not None:
+            self._update_solver(max_iterations, tolerance, debug)
+            return
+
+        #advance the linear sub-networks exactly
+        if self.linear_networks:
+            self._update_linear(max_iterations, tolerance, debug)
+            return
+
+        #one step of the generated function (debugging and profiling use the blocks)
+        if self.engine == "codegen" and not debug and self.profiler is None:
+            simulate = self._step_function([])
+            self.time, _, _ = simulate(self.blocks, self.time, self.time, np.inf, self.dt, 
+                                       max_iterations, tolerance, 1, 1, 0, None, None, 0)
+            return
+
         #increment simulation time
         self.time += self.dt
 
@@ -155,89 +793,946 @@ class Simulation:
             print("\ndebug status:")
             print("    time :", self.time)
 
-        steady_state = False
+        #advance the compiled arrays instead of the blocks
+        if self.array_engine is not None:
+            self.array_engine.update(self.time, self.dt, max_iterations, tolerance, debug)
+            return
+
+        #only compute the blocks whose sample times tick
+        if self.rate_ticks:
+            self._update_rates(max_iterations, tolerance, debug)
+            return
+
+        #compute the blocks in the order of the schedule
+        self.steady_state = self._compute_blocks(self.time, self.dt, max_iterations, tolerance, debug)
+
+        #update the outputs (blocks with internal states)
+        for block in self.update_order:
+            block.update_output()
+
+        if not self.steady_state:
+            print(f"Steady state not reached!")
+
+
+    def _update_rates(self, max_iterations=20, tolerance=1e-6, debug=False):
+
+        """
+        compute and update the blocks of the current timestep (time 
+        already incremented) whose sample times tick, the other blocks 
+        hold their outputs, blocks with a sample time get the time since 
+        their last tick as timestep
+
+        INPUTS:
+            max_iterations : (int) maximum numbver of fixed-point iterations
+            tolerance      : (float) tolerance for convergence of fixed-point iterations
+            debug          : (bool) print debugging info (convergence etc.)
+        """
+
+        #timesteps of the ticking sample times
+        timesteps = {None: self.dt}
+        for sample_time, (count, last_time) in self.rate_ticks.items():
+            tick = self._tick_count(self.time, sample_time)
+            if tick != count:
+                timesteps[sample_time] = self.time - last_time
+                self.rate_ticks[sample_time] = (tick, self.time)
+
+        active = frozenset(timesteps)
+        if active not in self.rate_schedules:
+            self.rate_schedules[active] = self._rate_schedule(active)
+        schedule, updated_blocks = self.rate_schedules[active]
+
+        self.steady_state = True
+        for blocks, is_loop, sample_time in schedule:
+            dt = timesteps[sample_time]
+            if is_loop:
+                self.steady_state &= self._solve_loop(blocks, self.time, dt, max_iterations, tolerance, debug)
+            else:
+                for block in blocks:
+                    block.compute(self.time, dt)
+
+        for block in updated_blocks:
+            block.update_output()
+
+        if not self.steady_state:
+            print(f"Steady state not reached!")
+
+
+    def _compute_blocks(self, time, dt, max_iterations=20, tolerance=1e-6, debug=False, feedthrough_only=False):
+
+        """
+        compute the blocks in the order of the schedule and 
+        return if all algebraic loops converged
+
+        INPUTS:
+            time             : (float) simulation time
+            dt               : (float) timestep
+            max_iterations   : (int) maximum numbver of fixed-point iterations
+            tolerance        : (float) tolerance for convergence of fixed-point iterations
+            debug            : (bool) print debugging info (convergence etc.)
+            feedthrough_only : (bool) skip the blocks without feedthrough
+        """
+
+        steady_state = True
+
+        #the predictor needs one evaluation per timestep
+        predict = self.predictor is not None and not feedthrough_only
+        loop = 0
+
+        for blocks, is_loop in self.schedule:
+
+            if is_loop:
+                if predict:
+                    self._predict_loop(self.loop_history[loop], blocks)
+                steady_state &= self._solve_loop(blocks, time, dt, max_iterations, tolerance, debug)
+                loop += 1
+            elif feedthrough_only:
+                held = self.held_blocks
+                for block in blocks:
+                    if block.feedthrough and block not in held:
+                        block.compute(time, dt)
+            else:
+                for block in blocks:
+                    block.compute(time, dt)
+
+        return steady_state
+
+
+    def _predict_loop(self, history, blocks):
+
+        """
+        save the outputs of the loop blocks of the last timestep 
+        and set them to the extrapolation of the last timesteps 
+        (linear or quadratic) as initial guess of the iteration
+
+        INPUTS:
+            history : (list) outputs of the loop blocks of the last timesteps
+            blocks  : (list) blocks of the algebraic loop
+        """
+
+        history.append([block.output for block in blocks])
+        del history[:-3]
+
+        if self.predictor == "quadratic" and len(history) == 3:
+            guess = [3*y1 - 3*y2 + y3 for y1, y2, y3 in zip(history[-1], history[-2], history[-3])]
+        elif len(history) >= 2:
+            guess = [2*y1 - y2 for y1, y2 in zip(history[-1], history[-2])]
+        else:
+            return
+
+        for block, value in zip(blocks, guess):
+            block.output = value
+
+
+    def _solve_loop(self, blocks, time, dt, max_iterations=20, tolerance=1e-6, debug=False):
+
+        """
+        resolve an algebraic loop with the selected loop solver 
+        and return if it converged, newton and broyden fall back 
+        to fixed-point iteration if they do not converge
+
+        INPUTS:
+            blocks         : (list) blocks of the algebraic loop
+            time           : (float) simulation time
+            dt             : (float) timestep
+            max_iterations : (int) maximum numbver of iterations
+            tolerance      : (float) tolerance for convergence of the iterations
+            debug          : (bool) print debugging info (convergence etc.)
+        """
+
+        if debug:
+            print("    loop :", [f"{block.label}_{block.id}" for block in blocks])
+
+        if self.loop_solver != "fixed-point":
+
+            initial_outputs = [block.output for block in blocks]
+
+            if solve_newton(blocks, time, dt, max_iterations, tolerance, debug, 
+                            broyden=self.loop_solver == "broyden"):
+                return True
+
+            if debug:
+                print("    fallback to fixed-point iteration")
+
+            for block, output in zip(blocks, initial_outputs):
+                block.output = output
+
+        return solve_fixed_point(blocks, time, dt, max_iterations, tolerance, debug)
+
 
-        #perform fixed-ppoint iterations
+    def get_states(self):
+        """
+        returns the states of the integrators as vector
+        """
+        return np.array([block.output for block in self.integrators], dtype=float)
+
+
+    def set_states(self, states):
+        """
+        set the states of the integrators from a vector
+        """
+        for block, value in zip(self.integrators, states.tolist()):
+            block.output = block.temp_output = value
+
+
+    def derivative(self, time, states, max_iterations=20, tolerance=1e-6):
+
+        """
+        evaluate the block diagram as derivative function of the 
+        integrator states, sets the integrator outputs to 'states', 
+        computes all blocks with feedthrough at 'time' and returns 
+        the inputs of the integrators
+
+        INPUTS:
+            time           : (float) simulation time
+            states         : (array) states of the integrators
+            max_iterations : (int) maximum numbver of iterations for algebraic loops
+            tolerance      : (float) tolerance for convergence of algebraic loops
+        """
+
+        self.set_states(states)
+        self.steady_state &= self._compute_blocks(time, self.dt, max_iterations, tolerance, feedthrough_only=True)
+        return np.array([block.inputs['input'].output for block in self.integrators], dtype=float)
+
+
+    def _update_solver(self, max_iterations=20, tolerance=1e-6, debug=False):
+
+        """
+        perform one step of the global solver, all integrator 
+        states are advanced together by the selected method
+
+        INPUTS:
+            max_iterations : (int) maximum numbver of iterations for algebraic loops
+            tolerance      : (float) tolerance for convergence of algebraic loops
+            debug          : (bool) print debugging info (convergence etc.)
+        """
+
+        self.steady_state = True
+
+        func = lambda time, states: self.derivative(time, states, max_iterations, tolerance)
+
+        states = self.get_states()
+        dt = self.dt
+
+        #return to the regular steps after an event
+        if self.event_step_end is not None:
+            dt, self.event_step_end = self.event_step_end - self.time, None
+
+        if not self.comparators:
+            new_states, _ = self.solver.step(func, self.time, states, dt)
+        else:
+            #end the step where a comparator switches
+            solver = deepcopy(self.solver)
+            self._hold_comparators(func, states)
+            try:
+                new_states, _ = self.solver.step(func, self.time, states, dt)
+                new_states, event_dt = self._locate_event(func, states, new_states, dt, solver)
+            finally:
+                self.held_blocks = frozenset()
+            if event_dt < dt:
+                self.event_step_end, dt = self.time + dt, event_dt
+
+        if debug:
+            print("\ndebug status:")
+            print("    time :", self.time + dt)
+
+        self._commit_step(new_states, self.time + dt, dt, max_iterations, tolerance)
+
+        if not self.steady_state:
+            print(f"Steady state not reached!")
+
+
+    def _linear_schedule(self):
+
+        """
+        returns the schedule of the blocks with feedthrough outside 
+        of the linear sub-networks (exact linear mode) as the groups 
+        before and after the first dependency on the network outputs 
+        and if the networks have inputs from the groups after (then 
+        the networks and these groups are iterated), loops through 
+        the networks are closed by this iteration
+        """
+
+        members, dependent = set(), set()
+        for network in self.linear_networks:
+            members.update(network.blocks)
+            dependent.update(network.outputs)
+
+        before, after = [], []
+
+        for blocks, is_loop in self.schedule:
+
+            others = [block for block in blocks if block.feedthrough and block not in members]
+
+            if is_loop and others:
+                closed = len(others) == len(blocks)
+                if not closed or any(b in dependent for block in others for b in block.inputs.values()):
+                    dependent.update(others)
+                    after.append((others, closed))
+                else:
+                    before.append((others, True))
+                continue
+
+            for block in others:
+                groups = before
+                if any(b in dependent for b in block.inputs.values()):
+                    dependent.add(block)
+                    groups = after
+                if groups and not groups[-1][1]:
+                    groups[-1][0].append(block)
+                else:
+                    groups.append(([block], False))
+
+        coupled = any(block in dependent for network in self.linear_networks for block in network.inputs)
+
+        return before, after, coupled
+
+
+    def _compute_linear(self, time, dt, states, max_iterations=20, tolerance=1e-6, debug=False):
+
+        """
+        set the integrator states and compute the outputs of all 
+        blocks with feedthrough in the exact linear mode, the 
+        outputs of the networks are written as y = C x + D u and 
+        only the other blocks are computed one by one
+
+        INPUTS:
+            time           : (float) simulation time
+            dt             : (float) timestep
+            states         : (array) states of the integrators
+            max_iterations : (int) maximum numbver of iterations for algebraic loops
+            tolerance      : (float) tolerance for convergence of algebraic loops
+            debug          : (bool) print debugging info (convergence etc.)
+        """
+
+        self.set_states(states)
+        before, after, coupled = self.linear_schedule
+        network_states = [states[indices] for indices in self.linear_indices]
+
+        def compute(groups):
+            for blocks, is_loop in groups:
+                if is_loop:
+                    self.steady_state &= self._solve_loop(blocks, time, dt, max_iterations, tolerance, debug)
+                else:
+                    for block in blocks:
+                        block.compute(time, dt)
+
+        def write_outputs():
+            outputs = []
+            for network, x in zip(self.linear_networks, network_states):
+                y = network.output_values(x)
+                for block, value in zip(network.outputs, y.tolist()):
+                    block.output = value
+                outputs.append(y)
+            return outputs
+
+        compute(before)
+        outputs = write_outputs()
+
+        if not coupled:
+            compute(after)
+            return
+
+        #inputs of the networks that depend on their outputs
         for iteration in range(max_iterations):
+            compute(after)
+            new_outputs = write_outputs()
+            error = max((deviation(y, prev_y).max(initial=0) for y, prev_y in zip(new_outputs, outputs)), default=0)
+            if error < tolerance:
+                return
+            outputs = new_outputs
 
-            #save previous state for convergence checking
-            prev_state = self.get_state()
+        self.steady_state = False
 
-            #update states of all blocks
-            for block in self.blocks:
+
+    def _update_linear(self, max_iterations=20, tolerance=1e-6, debug=False):
+
+        """
+        perform one step of the exact linear mode, the states of 
+        every linear sub-network are advanced by its discretized 
+        state-space model (zero-order hold of the inputs from the 
+        other blocks), then the network outputs are set from the 
+        output matrices and the other blocks are computed
+
+        INPUTS:
+            max_iterations : (int) maximum numbver of iterations for algebraic loops
+            tolerance      : (float) tolerance for convergence of algebraic loops
+            debug          : (bool) print debugging info (convergence etc.)
+        """
+
+        self.steady_state = True
+
+        #inputs of the networks are consistent with the states after a step,
+        #otherwise (first step, reset, set_state) they are computed here
+        states = self.get_states()
+        if self.time != self.linear_time:
+            self._compute_linear(self.time, self.dt, states, max_iterations, tolerance, debug)
+
+        new_states = states.copy()
+        for network, indices in zip(self.linear_networks, self.linear_indices):
+            new_states[indices] = network.advance(states[indices], self.dt)
+
+        self.time += self.dt
+
+        if debug:
+            print("\ndebug status:")
+            print("    time :", self.time)
+
+        self._compute_linear(self.time, self.dt, new_states, max_iterations, tolerance, debug)
+
+        #other blocks with internal states (Differentiator, Subsystem)
+        if self.discrete_blocks:
+            for block in self.discrete_blocks:
                 block.compute(self.time, self.dt)
+                block.update_output()
+            self._compute_linear(self.time, self.dt, new_states, max_iterations, tolerance, debug)
+
+        #keep the integrators consistent for fixed-step updates
+        for block in self.integrators:
+            block.prev_input = block.inputs['input'].output
+
+        self.linear_time = self.time
+
+        if not self.steady_state:
+            print(f"Steady state not reached!")
+
+
+    def _update_adaptive(self, max_iterations=20, tolerance=1e-6, debug=False, t_stop=None):
+
+        """
+        perform one accepted step of the adaptive mode, the 
+        integrator states are advanced by the embedded runge-kutta 
+        pair and the timestep 'self.dt' is adjusted to the local 
+        error estimate (rtol, atol) for the next step
+
+        INPUTS:
+            max_iterations : (int) maximum numbver of iterations for algebraic loops
+            tolerance      : (float) tolerance for convergence of algebraic loops
+            debug          : (bool) print debugging info (convergence etc.)
+            t_stop         : (float) time that is not stepped over
+        """
+
+        self.steady_state = True
+
+        func = lambda time, states: self.derivative(time, states, max_iterations, tolerance)
+
+        states = self.get_states()
+
+        #do not step over the stop time
+        dt, clamped = self.dt, False
+        if t_stop is not None and self.time + dt >= t_stop:
+            dt, clamped = t_stop - self.time, True
+
+        #comparators switch only at the end of the accepted step
+        if self.comparators:
+            solver = deepcopy(self.solver)
+            self._hold_comparators(func, states)
+
+        #repeat the step with smaller timesteps until the error is accepted
+        while True:
 
-            #compute relative deviation
-            rel_errors = [abs((blk.output - prev_state[blk])/blk.output) 
-                          for blk in self.blocks if blk.output != 0.0]
-            max_rel_errors = max(rel_errors + [0])
+            new_states, error = self.solver.step(func, self.time, states, dt)
+            norm = error_norm(error, states, new_states, self.rtol, self.atol)
+            factor = step_factor(norm, self.solver.order)
 
             if debug:
-                print("        iteration  :", iteration+1)
-                print("        difference :", max_rel_errors)
+                print("\ndebug status:")
+                print("    time  :", self.time + dt)
+                print("    dt    :", dt)
+                print("    error :", norm)
 
-            #check for convergence
-            if max_rel_errors < tolerance:
-                steady_state = True
+            if norm <= 1.0 or dt <= self.min_dt:
                 break
 
-        #update the outputs (blocks with internal states)
-        for block in self.blocks:
-            block.update_output()
+            dt, clamped = max(dt * factor, self.min_dt), False
+
+        #next timestep, unless this step was shortened by the stop time
+        if not clamped:
+            self.dt = dt * factor
+        if self.max_dt is not None:
+            self.dt = min(self.dt, self.max_dt)
+
+        end_time = t_stop if clamped else self.time + dt
+
+        #end the step where a comparator switches
+        if self.comparators:
+            try:
+                new_states, event_dt = self._locate_event(func, states, new_states, dt, solver)
+            finally:
+                self.held_blocks = frozenset()
+            if event_dt < dt:
+                dt, end_time = event_dt, self.time + event_dt
+
+        self._commit_step(new_states, end_time, dt, max_iterations, tolerance)
 
-        if not steady_state:
+        if norm > 1.0:
+            print(f"Error tolerance not reached with minimum timestep!")
+
+        if not self.steady_state:
             print(f"Steady state not reached!")
 
 
+    def _event_values(self):
+        """
+        inputs of the comparators relative to their thresholds, 
+        a comparator switches where its value changes sign
+        """
+        return np.array([block.inputs['input'].output - block.threshold 
+                         for block in self.comparators], dtype=float)
+
+
+    def _hold_comparators(self, func, states):
+
+        """
+        make the comparator outputs consistent with the states at 
+        the start of the step and hold them during the stages of 
+        the solver, so every stage sees the same side of a switch, 
+        the comparators switch in '_commit_step' after the step
+
+        INPUTS:
+            func   : (callable) derivative function f(time, states)
+            states : (array) states at the beginning of the step
+        """
+
+        #comparator inputs at the start of the step (from the last step if available)
+        if self.event_values is None or self.event_values[0] != self.time:
+            func(self.time, states)
+            self.event_values = (self.time, self._event_values())
+
+        self.held_blocks = frozenset(self.comparators)
+
+
+    def _locate_event(self, func, states, new_states, dt, solver):
+
+        """
+        check if a comparator input crosses its threshold within a 
+        step of the global solver (with held comparator outputs) and 
+        shorten the step to the crossing, which is located by bisection 
+        of the step length with repeated steps from the start (to 
+        'event_tolerance'), returns the new states and the length of 
+        the step, the next step restarts with the switched comparators
+
+        INPUTS:
+            func       : (callable) derivative function f(time, states)
+            states     : (array) states at the beginning of the step
+            new_states : (array) states at the end of the step
+            dt         : (float) length of the step
+            solver     : (object) copy of the solver from before the step
+        """
+
+        time = self.time
+        start = self.event_values[1] >= 0
+
+        func(time + dt, new_states)
+        end = self._event_values() >= 0
+
+        if np.array_equal(start, end):
+            return new_states, dt
+
+        #the crossing is within (lower, upper], the repeated steps start 
+        #from the solver before the step (e.g. history of BDF2)
+        lower, upper = 0.0, dt
+        accepted_solver = self.solver
+        while upper - lower > self.event_tolerance:
+
+            middle = (lower + upper) / 2
+            middle_solver = deepcopy(solver)
+            middle_states, _ = middle_solver.step(func, time, states, middle)
+            func(time + middle, middle_states)
+            middle_end = self._event_values() >= 0
+
+            if np.array_equal(start, middle_end):
+                lower = middle
+            else:
+                upper, new_states, end = middle, middle_states, middle_end
+                accepted_solver = middle_solver
+
+        self.solver = accepted_solver
+
+        switched = [block for block, before, after in zip(self.comparators, start, end) if before != after]
+        self.events.append((time + upper, switched))
+
+        return new_states, upper
+
+
+    def _commit_step(self, states, time, dt, max_iterations=20, tolerance=1e-6):
+
+        """
+        set the new integrator states and time, make the outputs 
+        of all blocks consistent with them and update the other 
+        blocks with internal states (Differentiator, Subsystem)
+
+        INPUTS:
+            states         : (array) new states of the integrators
+            time           : (float) new simulation time
+            dt             : (float) length of the step
+            max_iterations : (int) maximum numbver of iterations for algebraic loops
+            tolerance      : (float) tolerance for convergence of algebraic loops
+        """
+
+        self.time = time
+        self.derivative(time, states, max_iterations, tolerance)
+
+        if self.discrete_blocks:
+            for block in self.discrete_blocks:
+                block.compute(time, dt)
+                block.update_output()
+            self.derivative(time, states, max_iterations, tolerance)
+
+        #keep the integrators consistent for fixed-step updates
+        for block in self.integrators:
+            block.prev_input = block.inputs['input'].output
+
+        #comparator inputs at the start of the next step
+        if self.comparators:
+            self.event_values = (time, self._event_values())
+
+
     @timer
-    def run(self, duration=10, max_iterations=100, tolerance=1e-6, debug=False):
+    def run(self, duration=10, max_iterations=100, tolerance=1e-6, debug=False, probes=None, decimation=1, output_times=None):
 
         """
         performs multiple simulation steps and returns 
-        the time series results over the time steps
+        the time series results of the probes over the 
+        time steps as numpy arrays, the recorded blocks 
+        are available as 'self.probes' afterwards
 
         INPUTS:
             total_time     : (float) simulation time [s]
             max_iterations : (int) maximum numbver of fixed-point iterations
             tolerance      : (float) tolerance for convergence of fixed-point iterations
             debug          : (bool) print debugging info (convergence etc.)
+            probes         : (list) ids of the blocks to record, defaults to 
+                             the Scope blocks (all blocks if there are none)
+            decimation     : (int) record only every n-th timestep
+            output_times   : (array) interpolate the results onto these 
+                             times (for the non-uniform adaptive timesteps)
         """
 
         #set local time
         start_time = self.time
 
-        #initialize the time series data
-        data = [[] for _ in range(len(self.blocks))]
-        time = []
+        #select the recorded blocks
+        self.probes = self._get_probes(probes)
+
+        #preallocate the time series data
+        n_samples = (ceil(duration / self.dt) + 1) // decimation + 1
+        batch_shape = () if self.batch_size is None else (self.batch_size,)
+        time = np.zeros(n_samples)
+        data = np.zeros((len(self.probes), n_samples) + batch_shape)
 
-        #iterate until duration is reached
-        while self.time - start_time < duration:
+        read_probes = self._probe_reader()
 
-            #perform one timestep
-            self.update(max_iterations, tolerance, debug)
+        step, sample = 0, 0
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.attach(self)
+
+        try:
+
+            #generated function steps and records until the buffers are full
+            simulate = self._step_function(self.probes) if self.engine == "codegen" and not debug and profiler is None else None
+
+            #iterate until duration is reached
+            while self.time - start_time < duration and not (self.adaptive and self.time >= start_time + duration):
+
+                #enlarge the buffers if the estimate was too small
+                if sample == n_samples:
+                    n_samples *= 2
+                    time = np.resize(time, n_samples)
+                    data = np.concatenate([data, np.zeros_like(data)], axis=1)
+
+                if simulate is not None:
+                    self.time, step, sample = simulate(self.blocks, self.time, start_time, duration, self.dt, max_iterations, 
+                                                       tolerance, np.inf, decimation, step, time, data, sample)
+                    continue
+
+                #perform one timestep
+                if profiler is not None:
+                    start = perf_counter()
+
+                self.update(max_iterations, tolerance, debug, start_time + duration)
+                step += 1
+
+                if profiler is not None:
+                    profiler.step(self, perf_counter() - start)
+
+                if step % decimation:
+                    continue
             
-            #save the current state
-            time.append(self.time)
-            for i, val in enumerate(self.get_state().values()):
-                data[i].append(val)
+                #save the current state of the probes
+                if profiler is not None:
+                    start = perf_counter()
+
+                time[sample] = self.time
+                data[:, sample] = read_probes()
+                sample += 1
+
+                if profiler is not None:
+                    profiler.record(perf_counter() - start)
+
+        finally:
+
+            if profiler is not None:
+                profiler.detach()
+
+            if self.array_engine is not None:
+                self.array_engine.sync()
+
+        time, data = time[:sample], data[:, :sample]
+
+        #linear interpolation of every probe (and variant) onto the requested output times
+        if output_times is not None:
+            output_times = np.asarray(output_times, dtype=float)
+            rows = np.moveaxis(data, 1, -1)
+            values = np.array([np.interp(output_times, time, row) for row in rows.reshape((-1, len(time)))])
+            data = np.moveaxis(values.reshape(rows.shape[:-1] + (len(output_times),)), -1, 1)
+            time = output_times
 
         return time, data
 
 
+    def stream(self, duration=10, chunk_steps=1000, max_iterations=100, tolerance=1e-6, debug=False, probes=None, decimation=1, sinks=[]):
+
+        """
+        generator that performs multiple simulation steps and 
+        yields the time series of the probes in chunks of 
+        'chunk_steps' samples as (time, data) numpy arrays, 
+        so memory is bounded by the chunk size, the chunks 
+        are also written to the sinks (see sinks.py) which 
+        are closed when the stream ends
+
+        INPUTS:
+            duration       : (float) simulation time [s]
+            chunk_steps    : (int) number of recorded samples per chunk
+            max_iterations : (int) maximum numbver of fixed-point iterations
+            tolerance      : (float) tolerance for convergence of fixed-point iterations
+            debug          : (bool) print debugging info (convergence etc.)
+            probes         : (list) ids of the blocks to record, defaults to 
+                             the Scope blocks (all blocks if there are none)
+            decimation     : (int) record only every n-th timestep
+            sinks          : (list) Sink objects that receive the chunks
+        """
+
+        #set local time
+        start_time = self.time
+
+        #select the recorded blocks
+        self.probes = self._get_probes(probes)
+
+        #buffers for one chunk
+        batch_shape = () if self.batch_size is None else (self.batch_size,)
+        time = np.zeros(chunk_steps)
+        data = np.zeros((len(self.probes), chunk_steps) + batch_shape)
+
+        read_probes = self._probe_reader()
+
+        #column labels for the sinks
+        labels = ["time"]
+        for label in self._probe_labels():
+            if self.batch_size is None:
+                labels.append(label)
+            else:
+                labels.extend(f"{label}[{k}]" for k in range(self.batch_size))
+
+        for sink in sinks:
+            sink.open(labels)
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.attach(self)
+
+        step, sample = 0, 0
+
+        try:
+
+            #iterate until duration is reached
+            while self.time - start_time < duration and not (self.adaptive and self.time >= start_time + duration):
+
+                #perform one timestep
+                if profiler is not None:
+                    start = perf_counter()
+
+                self.update(max_iterations, tolerance, debug, start_time + duration)
+                step += 1
+
+                if profiler is not None:
+                    profiler.step(self, perf_counter() - start)
+
+                if step % decimation:
+                    continue
+
+                #save the current state of the probes
+                if profiler is not None:
+                    start = perf_counter()
+
+                time[sample] = self.time
+                data[:, sample] = read_probes()
+                sample += 1
+
+                if profiler is not None:
+                    profiler.record(perf_counter() - start)
+
+                #emit full chunks
+                if sample == chunk_steps:
+                    for sink in sinks:
+                        sink.write(time, data)
+                    yield time.copy(), data.copy()
+                    sample = 0
+
+            #emit the remaining samples
+            if sample > 0:
+                for sink in sinks:
+                    sink.write(time[:sample], data[:, :sample])
+                yield time[:sample].copy(), data[:, :sample].copy()
+
+        finally:
+
+            for sink in sinks:
+                sink.close()
+
+            if profiler is not None:
+                profiler.detach()
+
+            if self.array_engine is not None:
+                self.array_engine.sync()
+
+
+    def _probe_reader(self):
+        """
+        returns a function that reads the current 
+        outputs of the probes
+        """
+        if self.array_engine is not None:
+            indices = [self.blocks.index(block) for block in self.probes]
+            return lambda: self.array_engine.outputs[indices]
+        return lambda: [block.output for block in self.probes]
+
+
+    def _probe_labels(self):
+        """
+        labels of the probes, the label of Scope blocks 
+        and the type and id of all other blocks
+        """
+        return [block.label if isinstance(block, Scope) else f"{block.label}_{block.id}" 
+                for block in self.probes]
+
+
+    def _get_probes(self, probes=None):
+        """
+        resolve the ids of the probes to blocks, 
+        defaults to the Scope blocks
+        """
+        if probes is not None:
+            return [self.get_block(id) for id in probes]
+        scopes = [block for block in self.blocks if isinstance(block, Scope)]
+        return scopes if scopes else list(self.blocks)
+
+
     def reset(self):
         """
         reset the simulation to the initial state 
         and reset the simulation time
         """
         self.time = 0
-        self.set_state(self.initial_state)
+        self.linear_time = None
+        self.event_values = None
+        self.events = []
+        self.event_step_end = None
+        self.loop_history = [[] for _ in self.algebraic_loops]
+        self.rate_ticks = {sample_time: (0, 0) for sample_time in self.rate_ticks}
+        self.solver = deepcopy(self.initial_solver)
+        if self.adaptive:
+            self.dt = self.initial_dt
+        for block, state in self.initial_state.items():
+            block.set_full_state(state)
+        if self.array_engine is not None:
+            self.array_engine.load()
+
+
+    def checkpoint(self):
+        """
+        returns a Checkpoint with the complete state of the 
+        simulation (time, timestep, internal states of all 
+        blocks and of the solver) to resume from it later
+        """
+        if self.array_engine is not None:
+            self.array_engine.sync()
+        return Checkpoint(self.time, 
+                          self.dt, 
+                          [(block.id, type(block).__name__) for block in self.blocks], 
+                          deepcopy([block.get_full_state() for block in self.blocks]), 
+                          deepcopy(self.solver), 
+                          self.linear_time, 
+                          deepcopy(self.loop_history), 
+                          dict(self.rate_ticks), 
+                          self.event_step_end)
+
+
+    def restore(self, checkpoint):
+        """
+        restore a Checkpoint of this simulation or of another 
+        simulation with the same blocks (e.g. loaded from the 
+        same file), the simulation continues bit-identically
+        """
+        if checkpoint.blocks != [(block.id, type(block).__name__) for block in self.blocks]:
+            raise ValueError("Checkpoint does not match the blocks of the simulation")
+
+        for block, state in zip(self.blocks, deepcopy(checkpoint.states)):
+            block.set_full_state(state)
+
+        self.time = checkpoint.time
+        self.dt = checkpoint.dt
+        self.linear_time = checkpoint.linear_time
+        self.event_values = None
+        self.event_step_end = checkpoint.event_step_end
+        self.loop_history = deepcopy(checkpoint.loop_history)
+        self.rate_ticks.update(checkpoint.rate_ticks)
+
+        #internal state of the global solver (e.g. BDF2 history)
+        if checkpoint.solver is not None and type(checkpoint.solver) is type(self.solver):
+            self.solver = deepcopy(checkpoint.solver)
+
+        if self.array_engine is not None:
+            self.array_engine.load()
+
+
+    def save_checkpoint(self, filename):
+        """
+        save the complete state of the simulation to a binary file
+        """
+        write_checkpoint(self.checkpoint(), filename)
+
+
+    def load_checkpoint(self, filename):
+        """
+        restore the complete state of the simulation from a 
+        file written by 'save_checkpoint'
+        """
+        self.restore(read_checkpoint(filename))
 
 
     def get_block(self, id=0):
         """
         retrieve specific block by identifier
         """
-        return next((block for block in self.blocks if block.id==id))
+        if id not in self.block_index:
+            raise ValueError(f"No block with id {id!r}")
+        return self.block_index[id]
+
+
+    def get_subsystem(self, id):
+        """
+        hierarchical view of a flattened subsystem, returns its 
+        blocks by their ids within the subsystem (blocks of 
+        nested subsystems as '<subsystem id>.<block id>')
+        """
+        prefix = f"{id}."
+        blocks = {block.id[len(prefix):]: block for block in self.blocks 
+                  if isinstance(block.id, str) and block.id.startswith(prefix)}
+        if not blocks:
+            raise ValueError(f"No subsystem with id {id!r}")
+        return blocks
 
 
     def get_state(self):
@@ -245,6 +1740,8 @@ class Simulation:
         returns the current state of the simulation 
         (output values of all blocks)
         """
+        if self.array_engine is not None:
+            self.array_engine.sync()
         return {block: block.output for block in self.blocks}
 
 
@@ -256,6 +1753,8 @@ class Simulation:
         for block in self.blocks:
             if block in state:
                 block.output = state[block]
+        if self.array_engine is not None:
+            self.array_engine.load()
 
 
     def get_outputs(self):
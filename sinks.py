@@ -0,0 +1,120 @@
+#############################################################################
+##
+##                  SINKS FOR STREAMED RESULTS (sinks.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import numpy as np
+
+
+# FUNCS =====================================================================
+
+def chunk_to_rows(time, data):
+
+    """
+    arrange a chunk from 'Simulation.stream' as table with
+    one row per sample (time followed by the probe values,
+    batched probes are flattened variant by variant)
+
+    INPUTS:
+        time : (array) time vector of the chunk
+        data : (array) probe data of the chunk, (probes, samples[, variants])
+    """
+
+    values = np.moveaxis(data, 1, 0).reshape(len(time), -1)
+    return np.column_stack([time, values])
+
+
+# CLASSES ===================================================================
+
+class Sink:
+
+    """
+    base class for consumers of the chunks yielded by
+    'Simulation.stream', the stream opens the sink with
+    the column labels, writes every chunk and closes it
+    when the stream ends
+    """
+
+    def open(self, labels):
+        pass
+
+    def write(self, time, data):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class NpySink(Sink):
+
+    """
+    appends the streamed chunks to a .npy file with one row
+    per sample, the shape in the header is updated on close
+    so the file can be read with 'numpy.load' afterwards
+    """
+
+    #fixed header size, so the header can be rewritten in place
+    header_size = 128
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file     = None
+        self.rows     = 0
+        self.columns  = 0
+
+    def _write_header(self):
+
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (self.rows, self.columns)
+        header = header.ljust(self.header_size - 10 - 1) + "\n"
+
+        self.file.seek(0)
+        self.file.write(b"\x93NUMPY\x01\x00")
+        self.file.write(len(header).to_bytes(2, "little"))
+        self.file.write(header.encode("latin1"))
+
+    def open(self, labels):
+        self.file    = open(self.filename, "wb")
+        self.rows    = 0
+        self.columns = len(labels)
+        self._write_header()
+
+    def write(self, time, data):
+        rows = chunk_to_rows(time, data)
+        self.file.write(rows.astype("<f8").tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        if self.file is not None:
+            self._write_header()
+            self.file.close()
+            self.file = None
+
+
+class CsvSink(Sink):
+
+    """
+    appends the streamed chunks to a .csv file with a
+    header line and one row per sample
+    """
+
+    def __init__(self, filename, delimiter=","):
+        self.filename  = filename
+        self.delimiter = delimiter
+        self.file      = None
+
+    def open(self, labels):
+        self.file = open(self.filename, "w")
+        self.file.write(self.delimiter.join(labels) + "\n")
+
+    def write(self, time, data):
+        np.savetxt(self.file, chunk_to_rows(time, data), delimiter=self.delimiter)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
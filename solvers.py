@@ -0,0 +1,336 @@
+#############################################################################
+##
+##                  SOLVERS FOR THE INTEGRATORS (solvers.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+import numpy as np
+
+
+# CLASSES ===================================================================
+
+class ExplicitRungeKutta:
+
+    """
+    explicit runge-kutta method defined by its butcher tableau,
+    methods with an embedded lower order solution ('b_error')
+    also return an estimate of the local error
+    """
+
+    def __init__(self, a, b, c, b_error=None, order=1):
+
+        """
+        INPUTS:
+            a       : (list) lower triangular stage coefficients
+            b       : (list) weights of the solution
+            c       : (list) stage times (fractions of the timestep)
+            b_error : (list) weights of the embedded solution or None
+            order   : (int) order of the error estimate for step size control
+        """
+
+        self.a       = [np.array(row, dtype=float) for row in a]
+        self.b       = np.array(b, dtype=float)
+        self.c       = np.array(c, dtype=float)
+        self.b_error = None if b_error is None else self.b - np.array(b_error, dtype=float)
+        self.order   = order
+
+    @property
+    def adaptive(self):
+        return self.b_error is not None
+
+    def step(self, func, time, states, dt):
+
+        """
+        perform one step and return the new states and the
+        estimated local error (None without embedded solution)
+
+        INPUTS:
+            func   : (callable) derivative function f(time, states)
+            time   : (float) time at the beginning of the step
+            states : (array) states at the beginning of the step
+            dt     : (float) timestep
+        """
+
+        slopes = []
+        for a, c in zip(self.a, self.c):
+            stage = states + dt * np.dot(a, slopes[:len(a)]) if len(a) else states
+            slopes.append(func(time + c * dt, stage))
+
+        new_states = states + dt * np.dot(self.b, slopes)
+
+        if self.b_error is None:
+            return new_states, None
+
+        return new_states, dt * np.dot(self.b_error, slopes)
+
+
+class BackwardDifferentiation:
+
+    """
+    implicit backward differentiation formula (BDF) of order 1 
+    (backward euler) or 2 for stiff systems, the step equation 
+    for all states is solved together by newton iterations with 
+    a finite difference jacobian of the derivative function, 
+    the jacobian is reused across steps and only recomputed when 
+    the newton iteration converges slowly or not at all
+
+    if newton does not converge even with a new jacobian, the step 
+    is taken as two backward euler steps of half the timestep 
+    (recursively, at most 'max_halvings' times), if that also fails 
+    a ValueError is raised instead of accepting an unchecked step
+
+    BDF2 falls back to backward euler for the first step and 
+    whenever the timestep changed
+    """
+
+    adaptive = False
+
+    def __init__(self, order=1, tolerance=1e-8, max_iterations=10, max_halvings=8):
+
+        """
+        INPUTS:
+            order          : (int) order of the method (1 or 2)
+            tolerance      : (float) relative tolerance of the newton iterations
+            max_iterations : (int) maximum number of newton iterations per step
+            max_halvings   : (int) maximum number of timestep halvings when newton fails
+        """
+
+        if order not in (1, 2):
+            raise ValueError(f"BDF order {order} is not supported")
+
+        self.order          = order
+        self.tolerance      = tolerance
+        self.max_iterations = max_iterations
+        self.max_halvings   = max_halvings
+
+        #jacobian of the derivative function (reused across steps)
+        self.jacobian = None
+
+        #previous step for BDF2 (time, states, new states, timestep)
+        self.history = None
+
+    def _jacobian(self, func, time, states, slope):
+        """
+        forward difference approximation of the jacobian df/dx
+        """
+        jacobian = np.zeros((len(states), len(states)))
+        for j in range(len(states)):
+            h = 1.49e-8 * max(1.0, abs(states[j]))
+            perturbed = states.copy()
+            perturbed[j] += h
+            jacobian[:, j] = (func(time, perturbed) - slope) / h
+        return jacobian
+
+    def _newton(self, func, time, states, constant, beta):
+
+        """
+        solve x - beta * f(time, x) - constant = 0 with newton 
+        iterations starting at 'states', returns the solution 
+        or None if the iteration did not converge
+        """
+
+        identity = np.eye(len(states))
+        matrix = identity - beta * self.jacobian
+
+        x = states.copy()
+        prev_norm = None
+
+        for _ in range(self.max_iterations):
+
+            residual = x - beta * func(time, x) - constant
+
+            try:
+                dx = np.linalg.solve(matrix, -residual)
+            except np.linalg.LinAlgError:
+                return None
+
+            x = x + dx
+
+            norm = np.sqrt(np.mean((dx / (1.0 + np.abs(x)))**2)) if len(x) else 0.0
+
+            if not np.isfinite(norm):
+                return None
+
+            if norm <= self.tolerance:
+                return x
+
+            #convergence degraded, jacobian is outdated
+            if prev_norm is not None and norm > 0.5 * prev_norm:
+                return None
+
+            prev_norm = norm
+
+        return None
+
+    def _solve(self, func, time, states, dt, constant, beta):
+
+        """
+        solve the step equation from the explicit euler predictor, 
+        retry once with a new jacobian at the predictor, returns 
+        the new states or None if newton did not converge
+        """
+
+        slope = func(time, states)
+        guess = states + dt * slope
+
+        if self.jacobian is None or self.jacobian.shape != (len(states), len(states)):
+            self.jacobian = self._jacobian(func, time, states, slope)
+
+        new_states = self._newton(func, time + dt, guess, constant, beta)
+
+        if new_states is None:
+            self.jacobian = self._jacobian(func, time + dt, guess, func(time + dt, guess))
+            new_states = self._newton(func, time + dt, guess, constant, beta)
+
+        return new_states
+
+    def _substeps(self, func, time, states, dt, halvings=1):
+
+        """
+        advance the states by two backward euler steps of half 
+        the timestep, halving again where newton does not converge
+        """
+
+        if halvings > self.max_halvings:
+            raise ValueError(f"Newton iteration of the implicit solver did not converge "
+                             f"at time {time} (timestep reduced to {dt})")
+
+        dt = dt / 2
+        for _ in range(2):
+            new_states = self._solve(func, time, states, dt, states, dt)
+            if new_states is None:
+                new_states = self._substeps(func, time, states, dt, halvings + 1)
+            time, states = time + dt, new_states
+
+        return states
+
+    def step(self, func, time, states, dt):
+
+        """
+        perform one implicit step and return the new states
+        (no error estimate)
+
+        INPUTS:
+            func   : (callable) derivative function f(time, states)
+            time   : (float) time at the beginning of the step
+            states : (array) states at the beginning of the step
+            dt     : (float) timestep
+        """
+
+        #BDF2 with the previous step if it ended here with the same timestep
+        if (self.order == 2 and self.history is not None and self.history[3] == dt 
+            and self.history[0] == time and np.array_equal(self.history[2], states)):
+            constant = 4/3 * states - 1/3 * self.history[1]
+            beta = 2/3 * dt
+        else:
+            constant = states
+            beta = dt
+
+        new_states = self._solve(func, time, states, dt, constant, beta)
+
+        #shrink the timestep instead of accepting the predictor
+        if new_states is None:
+            new_states = self._substeps(func, time, states, dt)
+
+        self.history = (time + dt, states, new_states, dt)
+
+        return new_states, None
+
+
+# SOLVERS ===================================================================
+
+#forward euler, 1st order
+EULER = ExplicitRungeKutta(a=[[]],
+                           b=[1],
+                           c=[0],
+                           order=1)
+
+#classical runge-kutta, 4th order
+RK4 = ExplicitRungeKutta(a=[[],
+                            [1/2],
+                            [0, 1/2],
+                            [0, 0, 1]],
+                         b=[1/6, 1/3, 1/3, 1/6],
+                         c=[0, 1/2, 1/2, 1],
+                         order=4)
+
+#bogacki-shampine pair, 3rd order solution with 2nd order error estimate
+RK23 = ExplicitRungeKutta(a=[[],
+                             [1/2],
+                             [0, 3/4],
+                             [2/9, 1/3, 4/9]],
+                          b=[2/9, 1/3, 4/9, 0],
+                          c=[0, 1/2, 3/4, 1],
+                          b_error=[7/24, 1/4, 1/3, 1/8],
+                          order=2)
+
+#dormand-prince pair, 5th order solution with 4th order error estimate
+RK45 = ExplicitRungeKutta(a=[[],
+                             [1/5],
+                             [3/40, 9/40],
+                             [44/45, -56/15, 32/9],
+                             [19372/6561, -25360/2187, 64448/6561, -212/729],
+                             [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+                             [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]],
+                          b=[35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0],
+                          c=[0, 1/5, 3/10, 4/5, 8/9, 1, 1],
+                          b_error=[5179/57600, 0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40],
+                          order=4)
+
+#implicit solvers for stiff systems
+BACKWARD_EULER = BackwardDifferentiation(order=1)
+BDF2 = BackwardDifferentiation(order=2)
+
+#solvers that can be selected by name (copied by every simulation)
+SOLVERS = {
+    "euler"          : EULER,
+    "rk4"            : RK4,
+    "rk23"           : RK23,
+    "rk45"           : RK45,
+    "backward-euler" : BACKWARD_EULER,
+    "bdf2"           : BDF2,
+}
+
+
+# FUNCS =====================================================================
+
+def error_norm(error, states, new_states, rtol, atol):
+
+    """
+    scaled root-mean-square norm of the local error,
+    a step is accepted if the norm is at most 1
+
+    INPUTS:
+        error      : (array) estimated local error
+        states     : (array) states at the beginning of the step
+        new_states : (array) states at the end of the step
+        rtol       : (float) relative tolerance
+        atol       : (float) absolute tolerance
+    """
+
+    if len(error) == 0:
+        return 0.0
+
+    scale = atol + rtol * np.maximum(np.abs(states), np.abs(new_states))
+    return np.sqrt(np.mean((error / scale)**2))
+
+
+def step_factor(norm, order, safety=0.9, min_factor=0.2, max_factor=5.0):
+
+    """
+    factor for the next timestep from the error norm
+    of the current step (standard step size controller)
+
+    INPUTS:
+        norm  : (float) scaled error norm of the step
+        order : (int) order of the error estimate
+    """
+
+    if norm == 0.0:
+        return max_factor
+
+    return min(max_factor, max(min_factor, safety * norm**(-1 / (order + 1))))
@@ -0,0 +1,257 @@
+#############################################################################
+##
+##                  INTERPOLATION TABLES (tables.py)
+##
+##                            Milan Rother 2023
+##
+#############################################################################
+
+# IMPORTS ===================================================================
+
+from bisect import bisect_right
+
+import numpy as np
+
+
+# GLOBALS ===================================================================
+
+#interpolation methods of the tables
+METHODS = ("linear", "cubic")
+
+
+# FUNCS =====================================================================
+
+def spline_curvatures(x, y):
+
+    """
+    second derivatives of the cubic spline through the points
+    (x, y) at the breakpoints, with not-a-knot end conditions
+    (natural spline for three points), the end conditions are
+    eliminated so the system stays tridiagonal (thomas algorithm)
+
+    INPUTS:
+        x : (array) strictly increasing breakpoints
+        y : (array) values at the breakpoints
+    """
+
+    n = len(x)
+    curvatures = np.zeros(n)
+    if n < 3:
+        return curvatures
+
+    h = np.diff(x)
+    slopes = np.diff(y) / h
+
+    #system of the inner breakpoints
+    lower = h[:-1].copy()
+    diagonal = 2 * (h[:-1] + h[1:])
+    upper = h[1:].copy()
+    rhs = 6 * np.diff(slopes)
+
+    #not-a-knot, the curvature is linear over the first and last two segments
+    if n > 3:
+        diagonal[0] += h[0] * (1 + h[0] / h[1])
+        upper[0] -= h[0]**2 / h[1]
+        diagonal[-1] += h[-1] * (1 + h[-1] / h[-2])
+        lower[-1] -= h[-1]**2 / h[-2]
+
+    for i in range(1, n - 2):
+        factor = lower[i] / diagonal[i - 1]
+        diagonal[i] -= factor * upper[i - 1]
+        rhs[i] -= factor * rhs[i - 1]
+
+    inner = np.zeros(n - 2)
+    inner[-1] = rhs[-1] / diagonal[-1]
+    for i in range(n - 4, -1, -1):
+        inner[i] = (rhs[i] - upper[i] * inner[i + 1]) / diagonal[i]
+
+    curvatures[1:-1] = inner
+    if n > 3:
+        curvatures[0] = inner[0] - h[0] * (inner[1] - inner[0]) / h[1]
+        curvatures[-1] = inner[-1] + h[-1] * (inner[-1] - inner[-2]) / h[-2]
+    return curvatures
+
+
+def tabulate(func, lower, upper, tolerance=1e-6, method="cubic", max_points=2**16):
+
+    """
+    tabulate a function of one variable on a uniform grid over
+    [lower, upper], the grid is refined until the interpolation
+    error between the breakpoints is below 'tolerance'
+
+    INPUTS:
+        func       : (callable) function of one float
+        lower      : (float) lower end of the input range
+        upper      : (float) upper end of the input range
+        tolerance  : (float) largest absolute interpolation error
+        method     : (str) interpolation method, 'linear' or 'cubic'
+        max_points : (int) largest number of breakpoints
+    """
+
+    if not upper > lower:
+        raise ValueError(f"Empty input range for tabulation: [{lower}, {upper}]")
+
+    segments = 16
+    while True:
+
+        x = np.linspace(lower, upper, segments + 1)
+        table = Table(x, [func(v) for v in x.tolist()], method)
+
+        #check the error within the segments
+        test = (x[:-1, None] + np.diff(x)[:, None] * np.array([0.25, 0.5, 0.75])).ravel()
+        error = np.max(np.abs(table(test) - np.array([func(v) for v in test.tolist()])))
+
+        if error <= tolerance:
+            return table
+
+        if 2 * segments + 1 > max_points:
+            raise ValueError(f"Tabulation did not reach the tolerance {tolerance} "
+                             f"with {max_points} points (error {error})")
+
+        segments *= 2
+
+
+# CLASSES ===================================================================
+
+class Table:
+
+    """
+    1-D interpolation table with sorted breakpoints, 'linear' or
+    'cubic' (spline) interpolation, inputs outside of the
+    breakpoints are clamped to the first and last breakpoint
+
+    every segment is stored as polynomial of the distance to its
+    first breakpoint, the segment is found by indexing on uniform
+    grids and by binary search otherwise, calls with arrays are
+    vectorized and calls with floats use 'scalar', a function
+    with the table bound to local variables
+    """
+
+    def __init__(self, breakpoints, values, method="linear"):
+
+        """
+        INPUTS:
+            breakpoints : (array) strictly increasing inputs
+            values      : (array) outputs at the breakpoints
+            method      : (str) interpolation method, 'linear' or 'cubic'
+        """
+
+        x = np.asarray(breakpoints, dtype=float)
+        y = np.asarray(values, dtype=float)
+
+        if method not in METHODS:
+            raise ValueError(f"Unknown interpolation method: {method}")
+
+        if x.ndim != 1 or y.shape != x.shape or len(x) < 2:
+            raise ValueError("Table needs at least two breakpoints with one value each")
+
+        h = np.diff(x)
+        if np.any(h <= 0):
+            raise ValueError("Breakpoints of the table have to be strictly increasing")
+
+        self.breakpoints = x
+        self.values      = y
+        self.method      = method
+
+        #polynomial coefficients c0 + d*(c1 + d*(c2 + d*c3)) of the segments
+        if method == "linear":
+            c1, c2, c3 = np.diff(y) / h, np.zeros_like(h), np.zeros_like(h)
+        else:
+            m = spline_curvatures(x, y)
+            c1 = np.diff(y) / h - h * (2 * m[:-1] + m[1:]) / 6
+            c2 = m[:-1] / 2
+            c3 = np.diff(m) / (6 * h)
+
+        self.coefficients = np.stack([y[:-1], c1, c2, c3], axis=1)
+
+        #direct indexing for uniform breakpoints
+        self.uniform = bool(np.allclose(h, h[0], rtol=1e-9, atol=0))
+        self.inverse_spacing = 1 / h[0]
+
+        self._first, self._end = float(x[0]), float(x[-1])
+        self._last = len(h) - 1
+
+        self.scalar = self._scalar_function()
+
+    def __getstate__(self):
+        #the scalar function is not picklable
+        state = self.__dict__.copy()
+        del state["scalar"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.scalar = self._scalar_function()
+
+    def _scalar_function(self):
+
+        """
+        returns the interpolation of floats with the breakpoints 
+        and coefficients as python lists in local variables
+        """
+
+        x, coefficients = self.breakpoints.tolist(), self.coefficients.tolist()
+        first, end, last, inverse_spacing = self._first, self._end, self._last, self.inverse_spacing
+
+        if self.uniform:
+            def scalar(value):
+                if value < first:
+                    value = first
+                elif value > end:
+                    value = end
+                i = int((value - first) * inverse_spacing)
+                if i > last:
+                    i = last
+                c0, c1, c2, c3 = coefficients[i]
+                d = value - x[i]
+                return c0 + d * (c1 + d * (c2 + d * c3))
+        else:
+            def scalar(value):
+                if value < first:
+                    value = first
+                elif value > end:
+                    value = end
+                i = bisect_right(x, value) - 1
+                if i > last:
+                    i = last
+                c0, c1, c2, c3 = coefficients[i]
+                d = value - x[i]
+                return c0 + d * (c1 + d * (c2 + d * c3))
+
+        return scalar
+
+    def _segments(self, x):
+        if self.uniform:
+            i = np.floor((x - self._first) * self.inverse_spacing).astype(int)
+        else:
+            i = np.searchsorted(self.breakpoints, x, side="right") - 1
+        return np.clip(i, 0, self._last)
+
+    def __call__(self, x):
+
+        """
+        interpolated value at 'x' (float or array)
+        """
+
+        if isinstance(x, (float, int)):
+            return self.scalar(x)
+
+        x = np.clip(x, self._first, self._end)
+        i = self._segments(x)
+        c0, c1, c2, c3 = self.coefficients[i].T
+        d = x - self.breakpoints[i]
+        return c0 + d * (c1 + d * (c2 + d * c3))
+
+    def derivative(self, x):
+
+        """
+        derivative of the interpolation at the float 'x'
+        (zero outside of the breakpoints)
+        """
+
+        if x < self._first or x > self._end:
+            return 0.0
+        i = int(self._segments(x))
+        _, c1, c2, c3 = self.coefficients[i].tolist()
+        d = x - float(self.breakpoints[i])
+        return c1 + d * (2 * c2 + 3 * d * c3)